@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Build several configurations of the zlib package concurrently.
+
+Every combination of the given profiles, settings and options is built into
+the local Conan cache with `conan install --build`, ready for `conan upload`.
+The recipe is exported once.  The first build runs source(), and the others
+start as soon as the sources are ready, so every build shares that one
+read-only source tree.  The cores reported by conans.tools.cpu_count() are
+divided evenly between the builds that run at the same time.
+
+Each configuration runs in its own folder under the log directory, which
+gets its log and the files the generators write, so concurrent builds do not
+overwrite each other's conaninfo.txt or conanbuildinfo files.  Configurations
+that `conan info` resolves to the same package ID, such as two compiler
+releases that zlib's package_id() merges, are built one after another rather
+than at once, so two builds never write the same package in the cache.
+
+For example, to build the shared/static and Debug/Release matrix:
+
+    python build_matrix.py kent_at_multiscale/stable -o shared=True,False -s build_type=Debug,Release
+"""
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import conans.tools
+
+from conanfile import ZlibConan
+
+
+# Conan prints this once source() has finished, right before building.
+SOURCE_READY_MARKER = 'Copying sources to build folder'
+
+
+class Variant(object):
+    """
+    One configuration of the package to build.
+    """
+    def __init__(self, profile, settings, options):
+        self.profile = profile
+        self.settings = settings
+        self.options = options
+        self.returncode = None
+        self.seconds = None
+
+    @property
+    def name(self):
+        parts = []
+        if self.profile:
+            parts.append(os.path.basename(self.profile))
+        parts.extend('%s=%s' % (key, value) for key, value in self.settings)
+        parts.extend('%s=%s' % (key, value) for key, value in self.options)
+        return '_'.join(parts) or 'default'
+
+    def arguments(self):
+        arguments = []
+        if self.profile:
+            arguments.extend(['--profile', self.profile])
+        for key, value in self.settings:
+            arguments.extend(['-s', '%s=%s' % (key, value)])
+        for key, value in self.options:
+            arguments.extend(['-o', '%s:%s=%s' % (ZlibConan.name, key, value)])
+        return arguments
+
+    def command(self, reference, scopes):
+        command = ['conan', 'install', reference, '--build=%s' % (ZlibConan.name)] + self.arguments()
+        for scope in scopes:
+            command.extend(['--scope', scope])
+        return command
+
+    def package_id(self, reference, work_dir):
+        """
+        Asks Conan which package this configuration builds, or returns None
+        if it cannot say, in which case the build will report the error.
+        """
+        try:
+            output = subprocess.check_output(['conan', 'info', reference, '--only', 'id'] + self.arguments(), cwd=work_dir, stderr=subprocess.STDOUT, universal_newlines=True)
+        except subprocess.CalledProcessError:
+            return None
+        for line in output.splitlines():
+            key, _, value = line.strip().partition(':')
+            if key == 'ID':
+                return value.strip()
+        return None
+
+
+def expand(assignments):
+    """
+    Turns ['shared=True,False', 'backend=stock'] into every combination of
+    [('shared', 'True'), ('backend', 'stock')] and so on.
+    """
+    axes = []
+    for assignment in assignments:
+        key, _, values = assignment.partition('=')
+        if not key or not values:
+            raise ValueError('Expected NAME=VALUE[,VALUE...], not %s' % (assignment))
+        axes.append([(key, value) for value in values.split(',')])
+    return [list(combination) for combination in itertools.product(*axes)]
+
+
+def work_dir(log_dir, variant):
+    return os.path.join(os.path.abspath(log_dir), variant.name)
+
+
+def build(variant, reference, scopes, cores, log_dir, source_ready):
+    env = dict(os.environ)
+    env['CONAN_CPU_COUNT'] = str(cores)
+    cwd = work_dir(log_dir, variant)
+    log_path = os.path.join(cwd, 'build.log')
+    command = variant.command(reference, scopes)
+
+    start = time.time()
+    try:
+        with open(log_path, 'w') as log:
+            log.write('%s\n' % (' '.join(command)))
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, universal_newlines=True, cwd=cwd)
+            for line in iter(process.stdout.readline, ''):
+                log.write(line)
+                if SOURCE_READY_MARKER in line:
+                    source_ready.set()
+            variant.returncode = process.wait()
+    finally:
+        variant.seconds = time.time() - start
+        # Never leave the other builds waiting, even if this one failed early.
+        source_ready.set()
+
+    status = 'succeeded' if variant.returncode == 0 else 'FAILED'
+    print('%s %s in %.1fs, log in %s' % (variant.name, status, variant.seconds, log_path))
+    sys.stdout.flush()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('user_channel', help='user/channel to export the recipe to, e.g. kent_at_multiscale/stable')
+    parser.add_argument('-p', '--profile', action='append', default=[], help='profile to build with; repeat for several profiles')
+    parser.add_argument('-s', '--setting', action='append', default=[], help='NAME=VALUE[,VALUE...] setting values to build; repeat for several settings')
+    parser.add_argument('-o', '--option', action='append', default=[], help='NAME=VALUE[,VALUE...] zlib option values to build; repeat for several options')
+    parser.add_argument('--scope', action='append', default=[], help='scope passed to every build, e.g. ALL:skipTest=True')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of builds to run at once; defaults to one per configuration, up to the number of cores')
+    parser.add_argument('--log-dir', default='build_matrix_logs', help='directory for the per-configuration build folders and logs')
+    args = parser.parse_args(argv)
+
+    # The builds run in their own folders, so profiles given as paths must
+    # not be relative to this one.
+    profiles = [os.path.abspath(profile) if os.path.isfile(profile) else profile for profile in args.profile]
+    variants = [Variant(profile, settings, options)
+                for profile in (profiles or [None])
+                for settings in expand(args.setting)
+                for options in expand(args.option)]
+    for variant in variants:
+        if not os.path.isdir(work_dir(args.log_dir, variant)):
+            os.makedirs(work_dir(args.log_dir, variant))
+
+    recipe_dir = os.path.dirname(os.path.abspath(__file__))
+    reference = '%s/%s@%s' % (ZlibConan.name, ZlibConan.version, args.user_channel)
+    subprocess.check_call(['conan', 'export', args.user_channel], cwd=recipe_dir)
+
+    # Configurations with the same package ID build into the same folders in
+    # the cache, so each group of them is one job that builds them in turn.
+    groups = []
+    by_package_id = {}
+    for variant in variants:
+        package_id = variant.package_id(reference, work_dir(args.log_dir, variant))
+        if package_id is None:
+            groups.append([variant])
+        elif package_id in by_package_id:
+            print('%s is package %s, like %s; building them one after another' % (variant.name, package_id, by_package_id[package_id][0].name))
+            by_package_id[package_id].append(variant)
+        else:
+            by_package_id[package_id] = [variant]
+            groups.append(by_package_id[package_id])
+
+    cpu_count = conans.tools.cpu_count()
+    jobs = max(1, min(args.jobs or cpu_count, len(groups), cpu_count))
+    cores = max(1, cpu_count // jobs)
+    print('Building %s configurations, %s at a time with %s of %s cores each' % (len(variants), jobs, cores, cpu_count))
+
+    start = time.time()
+    source_ready = threading.Event()
+    slots = threading.Semaphore(jobs)
+
+    def run(group):
+        try:
+            for variant in group:
+                build(variant, reference, args.scope, cores, args.log_dir, source_ready)
+        finally:
+            slots.release()
+
+    threads = []
+    for index, group in enumerate(groups):
+        # Only the first build runs source(); the rest wait until it is done
+        # so they do not race to create the same source folder.
+        if index == 1:
+            source_ready.wait()
+        slots.acquire()
+        thread = threading.Thread(target=run, args=(group,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    wall_clock = time.time() - start
+
+    width = max(len(variant.name) for variant in variants)
+    print('')
+    print('%-*s  %-9s  %9s' % (width, 'configuration', 'status', 'seconds'))
+    for variant in variants:
+        status = 'ok' if variant.returncode == 0 else 'FAILED'
+        print('%-*s  %-9s  %9.1f' % (width, variant.name, status, variant.seconds))
+    print('')
+    print('Total wall-clock time %.1fs, %.1fs if built one after another' % (wall_clock, sum(variant.seconds for variant in variants)))
+
+    return 0 if all(variant.returncode == 0 for variant in variants) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Check that the recipe's pkg-config rewrite is byte-identical to the one it
+replaced.
+
+package() used to copy each .pc file into a temporary file from mkstemp()
+behind the conan_storage_path line, move the copy back over the original,
+and then run conans.tools.replace_in_file over the result.  It now streams
+each file through ZlibConan._rewrite_pkgconfig_file once.  This runs both on
+the same fixtures and fails if their output differs, or if rewriting a file
+a second time changes it:
+
+    python check_pkgconfig_rewrite.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import conans.tools
+
+from conanfile import ZlibConan
+
+
+CONAN_STORAGE_PATH = '/home/builder/.conan/data'
+PACKAGE_FOLDER = '%s/zlib/1.2.11/kent_at_multiscale/stable/package/5ab84d6acfe1f23c4fae0ab88f26e3a396351ac9' % (CONAN_STORAGE_PATH)
+
+TYPICAL = '''prefix=%s
+exec_prefix=${prefix}
+libdir=${exec_prefix}/lib
+sharedlibdir=${libdir}
+includedir=${prefix}/include
+
+Name: zlib
+Description: zlib compression library
+Version: 1.2.11
+
+Requires:
+Libs: -L${libdir} -L${sharedlibdir} -lz
+Cflags: -I${includedir}
+''' % (PACKAGE_FOLDER)
+
+FIXTURES = [
+    ('typical.pc', TYPICAL),
+    ('no_trailing_newline.pc', TYPICAL.rstrip('\n')),
+    ('repeated.pc', 'prefix=%s\nLibs: -L%s/lib -Wl,-rpath,%s/lib -lz\nCflags: -I%s/include\n' % ((PACKAGE_FOLDER,) * 4)),
+]
+
+
+class Output(object):
+    def info(self, message):
+        pass
+
+
+def old_rewrite(pkgconfig_file, conan_storage_path):
+    """
+    The rewrite package() did before it was streamed, unchanged.
+    """
+    _, tempname = tempfile.mkstemp()
+    with open(tempname, 'w') as output:
+        with open(pkgconfig_file, 'r') as input:
+            # TODO: replace this with something pkg-config can expand automatically
+            output.write('conan_storage_path=~/.conan/data\n')
+            for line in input:
+                output.write(line)
+    shutil.move(tempname, pkgconfig_file)
+    conans.tools.replace_in_file(pkgconfig_file, conan_storage_path, '${conan_storage_path}')
+
+
+def new_rewrite(pkgconfig_file, conan_storage_path):
+    recipe = ZlibConan.__new__(ZlibConan)
+    recipe.output = Output()
+    recipe._rewrite_pkgconfig_file(pkgconfig_file, conan_storage_path)
+
+
+def read(path):
+    with open(path, 'rb') as input:
+        return input.read()
+
+
+def main():
+    failures = 0
+    work_dir = tempfile.mkdtemp()
+    try:
+        for name, content in FIXTURES:
+            paths = []
+            for rewrite in (old_rewrite, new_rewrite):
+                directory = os.path.join(work_dir, rewrite.__name__)
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                path = os.path.join(directory, name)
+                with open(path, 'w') as output:
+                    output.write(content)
+                rewrite(path, CONAN_STORAGE_PATH)
+                paths.append(path)
+            old_bytes, new_bytes = [read(path) for path in paths]
+
+            # With no_copy_source, package() runs twice over the same files.
+            new_rewrite(paths[1], CONAN_STORAGE_PATH)
+            rerun_bytes = read(paths[1])
+
+            if old_bytes != new_bytes:
+                print('%s: FAILED, the outputs differ\n--- old\n%r\n--- new\n%r' % (name, old_bytes, new_bytes))
+                failures += 1
+            elif rerun_bytes != new_bytes:
+                print('%s: FAILED, rewriting it a second time changed it\n%r' % (name, rerun_bytes))
+                failures += 1
+            else:
+                print('%s: ok, %s identical bytes' % (name, len(new_bytes)))
+    finally:
+        shutil.rmtree(work_dir)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Compare zlib packages built with build_system=autotools and build_system=cmake.
+
+Build both into the local Conan cache first, for example with build_matrix.py,
+then compare them:
+
+    python build_matrix.py kent_at_multiscale/stable -o shared=True,False -o build_system=autotools,cmake
+    python compare_build_systems.py kent_at_multiscale/stable
+
+Each package is paired with the one built by the other build system with the
+same settings and the same other options, using the zlib_manifest.json in
+each.  A pair fails if the packages hold different files or symlinks, if
+their libraries differ in name or in the number of symbols they export, or
+if consumers would get different libraries, definitions or flags.  Headers
+and pkg-config files are also compared byte for byte, but differences there
+are only printed, since configure and CMake fill in zconf.h and zlib.pc from
+different templates.
+"""
+import argparse
+import difflib
+import json
+import os
+import sys
+
+from conanfile import ZlibConan
+
+
+# Files that describe the build rather than what it installed.
+BUILD_METADATA = ['conaninfo.txt', 'conanmanifest.txt', 'zlib_build_report.json', ZlibConan.manifest_name]
+
+
+def package_root(user_channel):
+    conan_user_home = os.getenv('CONAN_USER_HOME', '~')
+    user, channel = user_channel.split('/')
+    return os.path.join(os.path.expanduser(conan_user_home), '.conan', 'data', ZlibConan.name, ZlibConan.version, user, channel, 'package')
+
+
+def load_json(path):
+    with open(path, 'r') as input:
+        return json.load(input)
+
+
+def load_packages(root):
+    """
+    Returns (package folder, manifest) for every package with a manifest.
+    """
+    packages = []
+    if os.path.isdir(root):
+        for package_id in sorted(os.listdir(root)):
+            manifest_file = os.path.join(root, package_id, ZlibConan.manifest_name)
+            if os.path.isfile(manifest_file):
+                packages.append((os.path.join(root, package_id), load_json(manifest_file)))
+    return packages
+
+
+def configuration_key(manifest):
+    """
+    Everything about a package except its build system, so the two builds of
+    one configuration get the same key.
+    """
+    options = dict(manifest['options'])
+    options.pop('build_system', None)
+    return json.dumps([manifest['settings'], options], sort_keys=True)
+
+
+def tree(package_folder):
+    """
+    Maps each file's path relative to the package to None, or to the target
+    of a symlink.
+    """
+    entries = {}
+    for dirpath, dirnames, filenames in os.walk(package_folder):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            relative = os.path.relpath(path, package_folder)
+            if relative in BUILD_METADATA:
+                continue
+            if os.path.islink(path):
+                entries[relative] = os.readlink(path)
+            elif os.path.isfile(path):
+                entries[relative] = None
+    return entries
+
+
+def compare(autotools, cmake):
+    """
+    Prints how the two packages differ, and returns the number of
+    differences that matter to consumers.
+    """
+    (autotools_folder, autotools_manifest), (cmake_folder, cmake_manifest) = autotools, cmake
+    failures = 0
+
+    autotools_tree = tree(autotools_folder)
+    cmake_tree = tree(cmake_folder)
+    for path in sorted(set(autotools_tree) | set(cmake_tree)):
+        if path not in cmake_tree:
+            print('  only with autotools: %s' % (path))
+            failures += 1
+        elif path not in autotools_tree:
+            print('  only with cmake: %s' % (path))
+            failures += 1
+        elif autotools_tree[path] != cmake_tree[path]:
+            print('  %s links to %s with autotools but %s with cmake' % (path, autotools_tree[path], cmake_tree[path]))
+            failures += 1
+
+    for name in sorted(set(autotools_manifest['libraries']) | set(cmake_manifest['libraries'])):
+        autotools_library = autotools_manifest['libraries'].get(name)
+        cmake_library = cmake_manifest['libraries'].get(name)
+        if autotools_library is None or cmake_library is None:
+            continue  # Already reported as a missing file.
+        if autotools_library['exported_symbols'] != cmake_library['exported_symbols']:
+            print('  %s exports %s symbols with autotools but %s with cmake' % (name, autotools_library['exported_symbols'], cmake_library['exported_symbols']))
+            failures += 1
+        print('  %s is %s bytes with autotools and %s with cmake' % (name, autotools_library['bytes'], cmake_library['bytes']))
+
+    autotools_metadata = load_json(os.path.join(autotools_folder, ZlibConan.pkgconfig_metadata_name))
+    cmake_metadata = load_json(os.path.join(cmake_folder, ZlibConan.pkgconfig_metadata_name))
+    for key in ('libs', 'defines', 'cflags', 'linkflags'):
+        if autotools_metadata.get(key) != cmake_metadata.get(key):
+            print('  consumers get %s %s with autotools but %s with cmake' % (key, autotools_metadata.get(key), cmake_metadata.get(key)))
+            failures += 1
+
+    for path in sorted(autotools_tree):
+        if autotools_tree[path] is None and path in cmake_tree and (path.endswith('.h') or path.endswith('.pc')):
+            with open(os.path.join(autotools_folder, path), 'r') as input:
+                autotools_lines = input.readlines()
+            with open(os.path.join(cmake_folder, path), 'r') as input:
+                cmake_lines = input.readlines()
+            for line in difflib.unified_diff(autotools_lines, cmake_lines, 'autotools/%s' % (path), 'cmake/%s' % (path)):
+                print('    %s' % (line.rstrip('\n')))
+
+    return failures
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('user_channel', help='user/channel the packages were built for, e.g. kent_at_multiscale/stable')
+    args = parser.parse_args(argv)
+
+    root = package_root(args.user_channel)
+    by_build_system = {'autotools': {}, 'cmake': {}}
+    for package in load_packages(root):
+        build_system = package[1]['options'].get('build_system', 'autotools')
+        by_build_system[build_system][configuration_key(package[1])] = package
+
+    keys = sorted(set(by_build_system['autotools']) | set(by_build_system['cmake']))
+    if not keys:
+        print('No packages with a %s in %s' % (ZlibConan.manifest_name, root))
+        return 1
+
+    failed = 0
+    for key in keys:
+        autotools = by_build_system['autotools'].get(key)
+        cmake = by_build_system['cmake'].get(key)
+        settings, options = json.loads(key)
+        name = ' '.join('%s=%s' % (name, value) for name, value in sorted(list(settings.items()) + list(options.items())))
+        if autotools is None or cmake is None:
+            print('%s: only built with %s' % (name, 'cmake' if autotools is None else 'autotools'))
+            failed += 1
+            continue
+        print('%s: comparing %s with %s' % (name, os.path.basename(autotools[0]), os.path.basename(cmake[0])))
+        failures = compare(autotools, cmake)
+        print('%s: %s' % (name, 'FAILED, %s differences' % (failures) if failures else 'ok'))
+        if failures:
+            failed += 1
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,14 @@
+import collections
+import contextlib
 import glob
+import hashlib
+import json
 import os
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
 
 import conans
 
@@ -17,6 +23,7 @@ class ZlibConan(conans.ConanFile):
     external_version_patch = 11
     external_version = '%s.%s.%s' % (external_version_major, external_version_minor, external_version_patch)
     external_tag = 'v%s' % (external_version)
+    zlibng_tag = '2.0.7'
     version = '%s' % external_version
     description = 'The zlib library.'
     url = 'git@github.com:kent-at-multiscale/conan-zlib.git'
@@ -24,18 +31,152 @@ class ZlibConan(conans.ConanFile):
     author = 'Kent Rosenkoetter <kent.rosenkoetter@multiscalehn.com>'
     settings = 'os', 'compiler', 'build_type', 'arch'
     generators = 'env'
+    exports = 'build_matrix.py', 'contrib/*'
+    pkgconfig_metadata_name = 'zlib_pkgconfig.json'
+    manifest_name = 'zlib_manifest.json'
+    # zlib is configured and built out of tree, so every configuration can
+    # share one read-only copy of the sources.
+    no_copy_source = True
     options = {
-        'shared': [True, False]
+        'shared': [True, False],
+        'backend': ['stock', 'zlib-ng-compat'],
+        'optimize': ['none', 'lto', 'pgo'],
+        'march': ['default', 'x86-64', 'x86-64-v2', 'x86-64-v3', 'native'],
+        'contrib': [True, False],
+        'python': 'ANY',
+        'gc_sections': [True, False],
+        'max_mem_level': ['default', '1', '2', '3', '4', '5', '6', '7', '8', '9'],
+        'max_wbits': ['default', '9', '10', '11', '12', '13', '14', '15'],
+        'def_mem_level': ['default', '1', '2', '3', '4', '5', '6', '7', '8', '9'],
+        'unaligned_ok': [True, False],
+        'build_system': ['autotools', 'cmake'],
+        'exact_compiler_version': [True, False],
         }
-    default_options = 'shared=True'
+    default_options = (
+        'shared=True',
+        'backend=stock',
+        'optimize=none',
+        'march=default',
+        'contrib=False',
+        'python=none',
+        'gc_sections=False',
+        'max_mem_level=default',
+        'max_wbits=default',
+        'def_mem_level=default',
+        'unaligned_ok=False',
+        'build_system=autotools',
+        'exact_compiler_version=False',
+        )
     
     def configure(self):
         """
         Using different compilers and build types will produce different binaries.
         However, the C++ standard library makes no difference since this is pure
         C code.  Therefore, remove libcxx from the data used to compute the ID.
+        
+        Link-time and profile-guided optimization rely on GCC and Clang flags,
+        so reject them for any other compiler.  Clang cannot emit fat LTO
+        objects, so a static library built with them would hold only LLVM
+        bitcode that the consumer's linker may not read; those builds must
+        be shared.  The same goes for targeting a
+        particular x86-64 micro-architecture level, which additionally needs
+        an x86-64 build and a compiler new enough to know the level names.
+        Section garbage collection and symbol visibility also use GCC and
+        Clang flags.
+        
+        The memory tuning options override zlib's compile-time constants,
+        which only stock zlib reads.  The default memory level cannot exceed
+        the maximum, and unaligned loads are only allowed on architectures
+        that support them.
+        
+        Profile-guided optimization trains with the minigzip programs the
+        autotools build links the way the package is, so it cannot be
+        combined with the CMake build.
+        
+        The python option must name a Python 3 interpreter that runs here,
+        since package_id() asks it which extension modules it loads.
         """
         del self.settings.compiler.libcxx
+        
+        if self.options.optimize != 'none' and self.settings.compiler not in ('gcc', 'clang', 'apple-clang'):
+            raise conans.errors.ConanException('optimize=%s requires gcc, clang or apple-clang, not %s' % (self.options.optimize, self.settings.compiler))
+        if self.options.optimize != 'none' and self.settings.compiler in ('clang', 'apple-clang') and not self.options.shared:
+            raise conans.errors.ConanException('optimize=%s with %s requires shared=True, because the static library would contain only LLVM bitcode' % (self.options.optimize, self.settings.compiler))
+        
+        if self.options.march != 'default':
+            if self.settings.compiler not in ('gcc', 'clang', 'apple-clang'):
+                raise conans.errors.ConanException('march=%s requires gcc, clang or apple-clang, not %s' % (self.options.march, self.settings.compiler))
+            if self.options.march != 'native' and self.settings.arch != 'x86_64':
+                raise conans.errors.ConanException('march=%s requires arch=x86_64, not %s' % (self.options.march, self.settings.arch))
+            if self.options.march in ('x86-64-v2', 'x86-64-v3'):
+                compiler_major = int(str(self.settings.compiler.version).split('.')[0])
+                # Apple Clang 13 is the first based on LLVM 12.
+                if (self.settings.compiler == 'gcc' and compiler_major < 11) or (self.settings.compiler == 'clang' and compiler_major < 12) or (self.settings.compiler == 'apple-clang' and compiler_major < 13):
+                    raise conans.errors.ConanException('march=%s requires gcc 11, clang 12 or apple-clang 13 or newer' % (self.options.march))
+            if self.options.march == 'native':
+                self.output.warn('march=native produces a binary that only runs on CPUs like the build machine, but the package ID cannot tell which CPU that was.')
+        
+        if self.options.gc_sections and self.settings.compiler not in ('gcc', 'clang', 'apple-clang'):
+            raise conans.errors.ConanException('gc_sections requires gcc, clang or apple-clang, not %s' % (self.settings.compiler))
+        
+        tuning_defines = self._tuning_defines()
+        if tuning_defines and self.options.backend != 'stock':
+            raise conans.errors.ConanException('Overriding %s requires backend=stock, not %s' % (', '.join(tuning_defines), self.options.backend))
+        if self.options.def_mem_level != 'default':
+            max_mem_level = 9 if self.options.max_mem_level == 'default' else int(str(self.options.max_mem_level))
+            if int(str(self.options.def_mem_level)) > max_mem_level:
+                raise conans.errors.ConanException('def_mem_level=%s cannot be larger than max_mem_level=%s' % (self.options.def_mem_level, max_mem_level))
+        if self.options.unaligned_ok and self.settings.arch not in ('x86', 'x86_64', 'armv8'):
+            raise conans.errors.ConanException('unaligned_ok requires arch x86, x86_64 or armv8, not %s' % (self.settings.arch))
+        
+        if self.options.optimize == 'pgo' and self.options.build_system == 'cmake':
+            raise conans.errors.ConanException('optimize=pgo requires build_system=autotools')
+        
+        if self.options.python != 'none':
+            self._python_ext_suffix()
+    
+    def package_id(self):
+        """
+        zlib is C, and GCC since 5, Clang since 4 and Apple Clang keep the C
+        ABI stable across the releases that share a major version.  Only the
+        major version goes into the ID, so a patch-level compiler update
+        reuses the existing binaries instead of rebuilding identical code.
+        Older GCC and Clang number their release series by major and minor
+        version, so those keep the full version.
+        
+        LTO and PGO builds keep the exact version, because their static
+        libraries carry LTO bytecode that only the same compiler release can
+        read.  Set exact_compiler_version to keep it for every build.
+        
+        The python option names an interpreter, but what the zlibbuf module
+        depends on is the interpreter's ABI.  The ID uses the extension
+        suffix it reports instead, such as .cpython-36m-x86_64-linux-gnu.so,
+        so python3 and /usr/bin/python3.6 share a package when they are the
+        same Python, and python3 gets a new one when it is upgraded.
+        """
+        if self.options.python != 'none':
+            self.info.options.python = self._python_ext_suffix()
+        
+        if self.options.exact_compiler_version or self.options.optimize != 'none':
+            return
+        compiler = str(self.settings.compiler)
+        major = str(self.settings.compiler.version).split('.')[0]
+        if (compiler == 'gcc' and int(major) >= 5) or (compiler == 'clang' and int(major) >= 4) or compiler == 'apple-clang':
+            self.info.settings.compiler.version = major
+    
+    def _python_ext_suffix(self):
+        """
+        Returns the file name suffix the interpreter in the python option
+        uses for extension modules, which encodes its version and ABI.
+        """
+        command = [str(self.options.python), '-c', 'import sysconfig; print(sysconfig.get_config_var("EXT_SUFFIX"))']
+        try:
+            ext_suffix = subprocess.check_output(command, stderr=subprocess.STDOUT).decode('utf-8').strip()
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise conans.errors.ConanException('python=%s must name a Python 3 interpreter that runs on this machine: %s' % (self.options.python, e))
+        if ext_suffix in ('', 'None'):
+            raise conans.errors.ConanException('python=%s must name a Python 3 interpreter, but it reports no extension suffix' % (self.options.python))
+        return ext_suffix
     
     def system_requirements(self):
         if self.scope.installTools:
@@ -48,19 +189,138 @@ class ZlibConan(conans.ConanFile):
                 installer.install('libtool')
                 installer.install('make')
                 installer.install('pkg-config')
+                if self.options.build_system == 'cmake':
+                    installer.install('cmake')
+                    installer.install('ninja-build')
             except:
                 self.output.warn('Unable to bootstrap required build tools.  If they are already installed, you can ignore this warning.')
     
     def source(self):
 #         self.run('git clone https://github.com/madler/zlib.git -b %s' % (self.external_tag))
         zip_name = 'zlib-1.2.11.tar.gz'
-        conans.tools.download('http://zlib.net/%s' % zip_name, zip_name)
-        conans.tools.check_sha256(zip_name, 'c3e5e9fdd5004dcb542feda5ee4f0ff0744628baf8ed2dd5d66f8ca1197cb1a1')
-        conans.tools.unzip(zip_name)
+        archive = self._fetch_source_archive(zip_name, 'c3e5e9fdd5004dcb542feda5ee4f0ff0744628baf8ed2dd5d66f8ca1197cb1a1', [
+            'https://zlib.net/%s' % (zip_name),
+            'https://zlib.net/fossils/%s' % (zip_name),
+            'https://github.com/madler/zlib/releases/download/%s/%s' % (self.external_tag, zip_name),
+            ])
+        conans.tools.unzip(archive)
         shutil.move('zlib-1.2.11', 'zlib')
-        os.remove(zip_name)
+        if archive == zip_name:
+            os.remove(zip_name)
+        
+        # This edits the configure script so that dynamic libraries built
+        # on Mac are named using @rpath rather than the absolute path of where
+        # they were originally installed.  This is to make them relocatable.
+        if conans.tools.os_info.is_macos:
+            conans.tools.replace_in_file(os.path.join('zlib', 'configure'), '-install_name $libdir/$SHAREDLIBM', '-install_name @rpath/$SHAREDLIBM')
+    
+    def _fetch_source_archive(self, archive_name, sha256, urls):
+        """
+        Look for the archive in a local cache keyed by its SHA-256, and only
+        go to the network on a miss.  Otherwise try each mirror and then each
+        of the given URLs in order, and store the first copy whose checksum
+        matches in the cache.
+        
+        The cache lives in ~/.conan/source_cache (under CONAN_USER_HOME if
+        that is set).  Set CONAN_ZLIB_SOURCE_CACHE to use a different
+        directory, or to an empty string to disable the cache.
+        
+        Set CONAN_ZLIB_MIRRORS to a whitespace-separated list of mirrors to
+        try before the public ones.  Each one can be an http://, https:// or
+        file:// URL, or a plain local directory, containing the archive
+        under archive_name.
+        
+        Returns the path to the archive.  This is either the cache entry, or
+        the archive downloaded to the current directory if there is no cache.
+        """
+        cache_dir = os.getenv('CONAN_ZLIB_SOURCE_CACHE')
+        if cache_dir is None:
+            conan_user_home = os.getenv('CONAN_USER_HOME', '~')
+            cache_dir = os.path.join(os.path.expanduser(conan_user_home), '.conan', 'source_cache')
+        
+        cached_archive = None
+        if cache_dir:
+            # Keep the original file name inside the hash directory, because
+            # unzip() picks the extraction method from the extension.
+            cached_archive = os.path.join(os.path.expanduser(cache_dir), 'sha256', sha256, archive_name)
+            if os.path.isfile(cached_archive):
+                if self._sha256(cached_archive) == sha256:
+                    self.output.info('Using cached %s from %s' % (archive_name, cached_archive))
+                    return cached_archive
+                self.output.warn('Removing cached %s because its checksum does not match' % (cached_archive))
+                os.remove(cached_archive)
+        
+        mirrors = os.getenv('CONAN_ZLIB_MIRRORS', '').split()
+        locations = ['%s/%s' % (mirror.rstrip('/'), archive_name) if '://' in mirror else os.path.join(mirror, archive_name) for mirror in mirrors]
+        locations.extend(urls)
+        
+        for location in locations:
+            try:
+                if location.startswith('file://'):
+                    self.output.info('Copying %s from %s' % (archive_name, location))
+                    shutil.copyfile(location[len('file://'):], archive_name)
+                elif '://' in location:
+                    conans.tools.download(location, archive_name)
+                else:
+                    self.output.info('Copying %s from %s' % (archive_name, location))
+                    shutil.copyfile(os.path.expanduser(location), archive_name)
+            except Exception as e:
+                self.output.warn('Unable to fetch %s from %s: %s' % (archive_name, location, e))
+                continue
+            
+            if self._sha256(archive_name) != sha256:
+                self.output.warn('Ignoring %s from %s because its checksum does not match' % (archive_name, location))
+                os.remove(archive_name)
+                continue
+            
+            if not cached_archive:
+                return archive_name
+            
+            # Copy into a temporary file next to the final location and rename
+            # it into place, so concurrent builds never see a partial entry.
+            cached_dir = os.path.dirname(cached_archive)
+            if not os.path.isdir(cached_dir):
+                os.makedirs(cached_dir)
+            fd, tempname = tempfile.mkstemp(dir=cached_dir)
+            os.close(fd)
+            shutil.copyfile(archive_name, tempname)
+            os.rename(tempname, cached_archive)
+            os.remove(archive_name)
+            self.output.info('Cached %s as %s' % (archive_name, cached_archive))
+            return cached_archive
+        
+        raise conans.errors.ConanException('Unable to fetch %s with SHA-256 %s from any of %s' % (archive_name, sha256, ', '.join(locations)))
+    
+    def _fetch_zlibng(self, source_dir):
+        """
+        Unpacks the zlib-ng sources into source_dir.  Only builds with
+        backend=zlib-ng-compat need them, and source() runs once for every
+        configuration, so they are fetched here rather than there, through
+        the same checksum and cache as the zlib archive.
+        """
+        zip_name = 'zlib-ng-%s.tar.gz' % (self.zlibng_tag)
+        self.output.info('Fetching zlib-ng %s' % (self.zlibng_tag))
+        archive = self._fetch_source_archive(zip_name, '6c0853bb27738b811f2b4d4af095323c3d5ce36ceed6b50e5f773204fb8f7200', [
+            'https://github.com/zlib-ng/zlib-ng/archive/%s.tar.gz' % (self.zlibng_tag),
+            ])
+        destination = os.path.dirname(source_dir)
+        conans.tools.unzip(archive, destination)
+        shutil.move(os.path.join(destination, 'zlib-ng-%s' % (self.zlibng_tag)), source_dir)
+        if archive == zip_name:
+            os.remove(zip_name)
+    
+    @staticmethod
+    def _sha256(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as input:
+            for block in iter(lambda: input.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
     
     def build(self):
+        self._build_phases = []
+        build_start = time.time()
+        
         build_env = conans.AutoToolsBuildEnvironment(self)
         build_env.fpic = True
         
@@ -75,8 +335,44 @@ class ZlibConan(conans.ConanFile):
         for p in rpath:
             build_env.link_flags.append('-Wl,-rpath,%s' % (p))
         
+        if self.options.march != 'default':
+            build_env.flags.append('-march=%s' % (self.options.march))
+        
+        # zlib's Makefile ignores CPPFLAGS, so the definitions go in CFLAGS.
+        for name, value in self._tuning_defines().items():
+            build_env.flags.append('-D%s' % (name) if value is None else '-D%s=%s' % (name, value))
+        
+        if self.options.optimize != 'none':
+            build_env.flags.append('-flto')
+            build_env.link_flags.append('-flto')
+            if self.settings.compiler == 'gcc':
+                # Fat objects keep regular machine code next to the LTO
+                # bytecode so the static library still links without -flto.
+                build_env.flags.append('-ffat-lto-objects')
+        
+        # Put every function and variable in its own section so the linker
+        # can drop the unused ones, and hide everything that is not part of
+        # the public API.  zconf.h only defines ZEXTERN when it is not
+        # already defined, so a header included ahead of every source file
+        # gives each function declared in zlib.h default visibility.
+        if self.options.gc_sections:
+            visibility_header = os.path.join(self.build_folder, 'zlib_visibility.h')
+            with open(visibility_header, 'w') as output:
+                output.write('#define ZEXTERN extern __attribute__((visibility("default")))\n')
+            build_env.flags.extend(['-ffunction-sections', '-fdata-sections', '-fvisibility=hidden', '-include', visibility_header])
+            build_env.link_flags.append(self._gc_sections_link_flag())
+        
         vars = build_env.vars
         
+        # Static archives of LTO objects need an archiver that understands them.
+        if self.options.optimize != 'none':
+            if self.settings.compiler == 'gcc':
+                vars['AR'] = 'gcc-ar'
+                vars['RANLIB'] = 'gcc-ranlib'
+            elif self.settings.compiler == 'clang':
+                vars['AR'] = 'llvm-ar'
+                vars['RANLIB'] = 'llvm-ranlib'
+        
 #         conan_storage_path = conans.client.client_cache.ConanClientConfigParser.storage_path
         # TODO: Replace this with the already-configured storage path in Conan
         conan_user_home = os.getenv('CONAN_USER_HOME', '~')
@@ -86,6 +382,36 @@ class ZlibConan(conans.ConanFile):
         
         vars['PKG_CONFIG'] = pkgconfig_exec
         
+        # A compiler cache does not change the generated binaries, so it is
+        # controlled by a scope instead of an option.
+        compiler_cache = self._compiler_cache()
+        if compiler_cache:
+            compiler = os.getenv('CC')
+            if not compiler:
+                if self.settings.compiler == 'gcc':
+                    compiler = 'gcc'
+                elif self.settings.compiler in ('clang', 'apple-clang'):
+                    compiler = 'clang'
+                else:
+                    compiler = 'cc'
+            # CMake takes the cache as a launcher instead.
+            if self.options.build_system == 'autotools':
+                vars['CC'] = '%s %s' % (compiler_cache, compiler)
+            if compiler_cache == 'ccache':
+                # Hash paths relative to the folder holding both the sources
+                # and the build, so the same sources built in a different
+                # Conan build folder still hit.
+                source_and_build = [os.path.realpath(self.source_folder) + os.sep, os.path.realpath(self.build_folder) + os.sep]
+                vars['CCACHE_BASEDIR'] = os.path.dirname(os.path.commonprefix(source_and_build))
+            if self.scope.compilerCacheDir:
+                cache_dir = os.path.realpath(os.path.expanduser(str(self.scope.compilerCacheDir)))
+                vars['CCACHE_DIR' if compiler_cache == 'ccache' else 'SCCACHE_DIR'] = cache_dir
+            self.output.info('Compiling through %s' % (compiler_cache))
+            # The cache only reports running totals, so take a snapshot to
+            # subtract from them at the end.
+            with conans.tools.environment_append(vars):
+                compiler_cache_stats = self._compiler_cache_stats(compiler_cache)
+        
         configure_flags = []
         if self.options.shared:
             configure_flags.append('--enable-shared')
@@ -97,29 +423,557 @@ class ZlibConan(conans.ConanFile):
         
         configure_flags.append('--warn')
         
+        # zlib-ng built in compatibility mode installs a drop-in libz with the
+        # same API and ABI as stock zlib, but with SIMD implementations of
+        # crc32, adler32, longest_match and the inflate fast path that are
+        # selected at runtime based on the CPU.
+        # zlib-ng's configure only builds in place, so autotools builds a
+        # freshly unpacked copy of its sources in the build folder.  Stock zlib is
+        # shared between builds and built out of tree.
+        # CMake always builds out of tree, and reuses the sources and build
+        # folder it finds so that Ninja only rebuilds what changed.  Only
+        # `conan build` in a local folder leaves them there; `conan install
+        # --build` starts from an empty build folder.
+        if self.options.backend == 'zlib-ng-compat':
+            source_dir = os.path.join(self.build_folder, 'zlib-ng')
+            if self.options.build_system == 'cmake':
+                build_dir = os.path.join(self.build_folder, 'zlib-ng-build')
+            else:
+                build_dir = source_dir
+            if self.options.build_system == 'cmake' and os.path.isdir(source_dir):
+                self.output.info('Reusing zlib-ng sources %s' % (source_dir))
+            else:
+                if os.path.isdir(source_dir):
+                    shutil.rmtree(source_dir)
+                with self._phase('fetch zlib-ng'):
+                    self._fetch_zlibng(source_dir)
+            configure_flags.append('--zlib-compat')
+        else:
+            source_dir = os.path.join(self.source_folder, 'zlib')
+            build_dir = os.path.join(self.build_folder, 'zlib-build')
+            if self.options.build_system == 'cmake':
+                # zlib's CMakeLists.txt renames zconf.h in the source folder,
+                # which autotools builds of the same sources still need, so
+                # CMake gets a copy of its own.
+                cmake_source_dir = os.path.join(self.build_folder, 'zlib-source')
+                if not os.path.isdir(cmake_source_dir):
+                    shutil.copytree(source_dir, cmake_source_dir)
+                source_dir = cmake_source_dir
+            elif os.path.isdir(build_dir):
+                shutil.rmtree(build_dir)
+        if not os.path.isdir(build_dir):
+            os.makedirs(build_dir)
+        
         cpu_count = conans.tools.cpu_count()
         self.output.info('Detected %s cores.' % (cpu_count))
         
-        # This edits the configure script so that dynamic libraries built
-        # on Mac are named using @rpath rather than the absolute path of where
-        # they were originally installed.  This is to make them relocatable.
-        if conans.tools.os_info.is_macos:
-            conans.tools.replace_in_file(os.path.join(os.curdir, 'zlib', 'configure'), '-install_name $libdir/$SHAREDLIBM', '-install_name @rpath/$SHAREDLIBM')
+        # Profile-guided optimization builds an instrumented library first,
+        # runs a training workload against it, and then rebuilds from scratch
+        # using the collected profile.
+        if self.options.optimize == 'pgo':
+            profile_dir = os.path.join(self.build_folder, 'pgo-profile')
+            if os.path.isdir(profile_dir):
+                shutil.rmtree(profile_dir)
+            os.makedirs(profile_dir)
+            
+            instrument_flags = '-fprofile-generate=%s' % (profile_dir)
+            instrumented_vars = dict(vars)
+            instrumented_vars['CFLAGS'] = '%s %s' % (vars['CFLAGS'], instrument_flags)
+            instrumented_vars['LDFLAGS'] = '%s %s' % (vars['LDFLAGS'], instrument_flags)
+            with conans.tools.environment_append(instrumented_vars):
+                self.output.info('Building instrumented library for profile-guided optimization')
+                self._configure_and_make(source_dir, build_dir, configure_flags, cpu_count, 'instrumented ')
+                with self._phase('train'):
+                    self._train_pgo(source_dir, build_dir)
+                if build_dir == source_dir:
+                    self.run('make distclean', cwd=build_dir)
+                else:
+                    shutil.rmtree(build_dir)
+                    os.makedirs(build_dir)
+            
+            if self.settings.compiler == 'gcc':
+                use_flags = '-fprofile-use=%s -fprofile-correction' % (profile_dir)
+            else:
+                # Clang writes raw profiles that must be merged before use.
+                profdata = os.path.join(profile_dir, 'zlib.profdata')
+                llvm_profdata = 'xcrun llvm-profdata' if self.settings.compiler == 'apple-clang' else 'llvm-profdata'
+                with self._phase('merge profile'):
+                    self.run('%s merge -output="%s" "%s"' % (llvm_profdata, profdata, profile_dir))
+                use_flags = '-fprofile-use=%s' % (profdata)
+            vars['CFLAGS'] = '%s %s' % (vars['CFLAGS'], use_flags)
+            vars['LDFLAGS'] = '%s %s' % (vars['LDFLAGS'], use_flags)
         
         with conans.tools.environment_append(vars):
-            # TODO: check for Windows and run appropriately
-            self.output.info('Configuring')
-            self.run('%s --prefix="%s" %s' % (os.path.join(os.curdir, 'configure'), self.package_folder, ' '.join(configure_flags)), cwd='zlib')
+            if self.options.build_system == 'cmake':
+                self._configure_and_build_cmake(source_dir, build_dir, vars, compiler_cache, cpu_count)
+            else:
+                # TODO: check for Windows and run appropriately
+                self._configure_and_make(source_dir, build_dir, configure_flags, cpu_count)
+            contrib_targets = self._contrib_targets()
+            if contrib_targets:
+                contrib_dir = os.path.join(self.build_folder, 'contrib-build')
+                if os.path.isdir(contrib_dir):
+                    shutil.rmtree(contrib_dir)
+                os.makedirs(contrib_dir)
+                self.output.info('Building %s' % (' and '.join(contrib_targets)))
+                with self._phase('make contrib'):
+                    self._make_contrib(source_dir, build_dir, contrib_dir, contrib_targets, cpu_count)
             
-            self.output.info('Compiling')
-            self.run('make -j%s' % (cpu_count), cwd='zlib')
-            
-            if not self.scope.skipTest:
+            if self.scope.skipTest:
+                self.output.info('Installing into Conan package folder %s' % (self.package_folder))
+                with self._phase('install'):
+                    self.run(self._install_command(), cwd=build_dir)
+            elif self.scope.parallelCheck:
+                self._check_and_install(build_dir, cpu_count)
+            else:
                 self.output.info('Running tests')
-                self.run('make -j%s check' % (cpu_count), cwd='zlib')
+                with self._phase('check'):
+                    self.run(self._check_command(cpu_count), cwd=build_dir)
+                
+                self.output.info('Installing into Conan package folder %s' % (self.package_folder))
+                with self._phase('install'):
+                    self.run(self._install_command(), cwd=build_dir)
+            
+            # zlib's CMakeLists.txt always builds and installs both libraries.
+            if self.options.build_system == 'cmake' and not self.options.shared:
+                self._remove_shared_libraries()
+            
+            if contrib_targets:
+                with self._phase('install contrib'):
+                    self._make_contrib(source_dir, build_dir, contrib_dir, ['install-%s' % (target) for target in contrib_targets], cpu_count)
             
-            self.output.info('Installing into Conan package folder %s' % (self.package_folder))
-            self.run('make install', cwd='zlib')
+            if compiler_cache:
+                self._report_compiler_cache(compiler_cache, compiler_cache_stats)
+        
+        # configure and CMake add flags of their own, so record what they
+        # settled on rather than what was passed in.
+        if self.options.build_system == 'cmake':
+            flags = self._cmake_flags(build_dir)
+        else:
+            flags = self._make_variables(os.path.join(build_dir, 'Makefile'), ['CC', 'CFLAGS', 'SFLAGS', 'LDFLAGS', 'LDSHARED'])
+        
+        benchmarks = []
+        if not self.scope.skipBenchmark:
+            with self._phase('benchmark'):
+                benchmarks = self._benchmark_minigzip(build_dir)
+        
+        # package() copies this into the package folder.
+        report = {
+            'benchmarks': benchmarks,
+            'cpu_count': cpu_count,
+            'flags': flags,
+            'parallel_check': bool(self.scope.parallelCheck) and not self.scope.skipTest,
+            'phases': self._build_phases,
+            'wall_seconds': round(time.time() - build_start, 3),
+            }
+        with open(os.path.join(self.build_folder, 'zlib_build_report.json'), 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    
+    @contextlib.contextmanager
+    def _phase(self, name, measure_cpu=True):
+        """
+        Records how long the enclosed commands took for the build report.  CPU
+        time covers this process and every child process that finished
+        within the phase, so it is only meaningful when nothing else is
+        running at the same time.
+        """
+        start_wall = time.time()
+        start_times = os.times()
+        try:
+            yield
+        finally:
+            wall_seconds = time.time() - start_wall
+            end_times = os.times()
+            phase = {'phase': name, 'wall_seconds': round(wall_seconds, 3)}
+            if measure_cpu:
+                cpu_seconds = sum(end_times[i] - start_times[i] for i in range(4))
+                phase['cpu_seconds'] = round(cpu_seconds, 3)
+                self.output.info('%s took %.1fs (%.1fs CPU)' % (name, wall_seconds, cpu_seconds))
+            else:
+                self.output.info('%s took %.1fs' % (name, wall_seconds))
+            self._build_phases.append(phase)
+    
+    def _check_and_install(self, build_dir, cpu_count):
+        """
+        Runs `make check` and `make install` at the same time.  Both only
+        read the finished build, so they do not interfere.  The install goes
+        into a staging folder which is merged into the package folder once
+        the tests pass, so a failing test never leaves a partial package.
+        """
+        staging_dir = os.path.join(self.build_folder, 'zlib-staging')
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir)
+        
+        failures = []
+        def check():
+            try:
+                with self._phase('check', measure_cpu=False):
+                    self.run(self._check_command(cpu_count), cwd=build_dir)
+            except Exception as e:
+                failures.append(e)
+        
+        self.output.info('Running tests while installing into staging folder %s' % (staging_dir))
+        with self._phase('check and install'):
+            check_thread = threading.Thread(target=check)
+            check_thread.start()
+            try:
+                with self._phase('install', measure_cpu=False):
+                    self.run(self._install_command(staging_dir), cwd=build_dir)
+            finally:
+                check_thread.join()
+        if failures:
+            raise failures[0]
+        
+        self.output.info('Installing into Conan package folder %s' % (self.package_folder))
+        staged_package = os.path.join(staging_dir, os.path.abspath(self.package_folder).lstrip(os.sep))
+        for root, dirs, files in os.walk(staged_package):
+            destination = os.path.join(self.package_folder, os.path.relpath(root, staged_package))
+            if not os.path.isdir(destination):
+                os.makedirs(destination)
+            for name in files:
+                source = os.path.join(root, name)
+                target = os.path.join(destination, name)
+                if os.path.lexists(target):
+                    os.remove(target)
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), target)
+                else:
+                    shutil.copy2(source, target)
+        shutil.rmtree(staging_dir)
+    
+    def _check_command(self, cpu_count):
+        if self.options.build_system == 'cmake':
+            return 'ctest --output-on-failure --parallel %s' % (cpu_count)
+        return 'make -j%s check' % (cpu_count)
+    
+    def _install_command(self, destdir=None):
+        """
+        The command that installs the build into the package folder, or
+        under destdir if that is given.
+        """
+        if self.options.build_system == 'cmake':
+            if destdir:
+                return 'cmake -E env DESTDIR="%s" cmake --build . --target install' % (destdir)
+            return 'cmake --build . --target install'
+        if destdir:
+            return 'make install DESTDIR="%s"' % (destdir)
+        return 'make install'
+    
+    def _remove_shared_libraries(self):
+        for pattern in ['libz.so*', 'libz.*dylib']:
+            for library in glob.glob(os.path.join(self.package_folder, 'lib', pattern)):
+                self.output.info('Deleting shared library %s' % (library))
+                os.remove(library)
+    
+    def _compiler_cache(self):
+        """
+        Returns the compiler cache requested with `--scope ALL:compilerCache=`,
+        which may be `ccache` or `sccache`, or None to compile directly.
+        """
+        compiler_cache = self.scope.compilerCache
+        if not compiler_cache or str(compiler_cache) == 'False':
+            return None
+        if str(compiler_cache) == 'True':
+            return 'ccache'
+        if str(compiler_cache) not in ('ccache', 'sccache'):
+            raise conans.errors.ConanException('compilerCache must be ccache or sccache, not %s' % (compiler_cache))
+        return str(compiler_cache)
+    
+    def _compiler_cache_stats(self, compiler_cache):
+        """
+        Returns the compiler cache's counters as a dict from name to count,
+        or None if they cannot be read.  The counters cover everything the
+        cache has seen, not just this build.
+        """
+        if compiler_cache == 'ccache':
+            command = ['ccache', '--print-stats']
+        else:
+            command = ['sccache', '--show-stats', '--stats-format=json']
+        try:
+            output = subprocess.check_output(command, stderr=subprocess.STDOUT).decode('utf-8', 'replace')
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.output.warn('Unable to read %s statistics: %s' % (compiler_cache, e))
+            return None
+        
+        counters = collections.OrderedDict()
+        if compiler_cache == 'ccache':
+            # One tab-separated name and value per line.
+            for line in output.splitlines():
+                fields = line.split()
+                if len(fields) == 2 and fields[1].isdigit() and 'timestamp' not in fields[0]:
+                    counters[fields[0]] = int(fields[1])
+        else:
+            # Nested objects of counts, such as cache_hits.counts.C/C++.
+            def flatten(prefix, value):
+                if isinstance(value, dict):
+                    for key in sorted(value):
+                        flatten('%s%s.' % (prefix, key), value[key])
+                elif isinstance(value, int) and not isinstance(value, bool):
+                    counters[prefix[:-1]] = value
+            try:
+                flatten('', json.loads(output).get('stats', {}))
+            except ValueError as e:
+                self.output.warn('Unable to parse %s statistics: %s' % (compiler_cache, e))
+                return None
+        return counters
+    
+    def _report_compiler_cache(self, compiler_cache, stats_before):
+        """
+        Logs how much each of the cache's counters grew since stats_before
+        was taken at the start of the build.  Other builds using the same
+        cache at the same time are counted too.
+        """
+        stats_after = self._compiler_cache_stats(compiler_cache)
+        if stats_before is None or stats_after is None:
+            return
+        self.output.info('%s statistics for this build:' % (compiler_cache))
+        for name, value in stats_after.items():
+            difference = value - stats_before.get(name, 0)
+            if difference:
+                self.output.info('    %s: %s' % (name, difference))
+    
+    def _configure_and_make(self, source_dir, build_dir, configure_flags, cpu_count, phase_prefix=''):
+        if build_dir == source_dir:
+            configure = os.path.join(os.curdir, 'configure')
+        else:
+            configure = os.path.join(source_dir, 'configure')
+        
+        self.output.info('Configuring')
+        with self._phase('%sconfigure' % (phase_prefix)):
+            self.run('%s --prefix="%s" %s' % (configure, self.package_folder, ' '.join(configure_flags)), cwd=build_dir)
+        
+        self.output.info('Compiling')
+        with self._phase('%scompile' % (phase_prefix)):
+            self.run('make -j%s' % (cpu_count), cwd=build_dir)
+    
+    def _tuning_defines(self):
+        """
+        The compile-time constants the memory tuning options override, as an
+        ordered mapping from name to value, or to None for a plain flag.
+        """
+        defines = collections.OrderedDict()
+        if self.options.max_mem_level != 'default':
+            defines['MAX_MEM_LEVEL'] = str(self.options.max_mem_level)
+        if self.options.max_wbits != 'default':
+            defines['MAX_WBITS'] = str(self.options.max_wbits)
+        if self.options.def_mem_level != 'default':
+            defines['DEF_MEM_LEVEL'] = str(self.options.def_mem_level)
+        if self.options.unaligned_ok:
+            defines['UNALIGNED_OK'] = None
+        return defines
+    
+    def _gc_sections_link_flag(self):
+        if self.settings.os == 'Macos':
+            return '-Wl,-dead_strip'
+        return '-Wl,--gc-sections'
+    
+    def _configure_and_build_cmake(self, source_dir, build_dir, vars, compiler_cache, cpu_count):
+        """
+        Configures and builds with zlib's own CMakeLists.txt and Ninja.  The
+        flags are passed as cache definitions rather than read from the
+        environment, because CMake only reads the environment when it first
+        configures a build folder.  The definitions keep the installed
+        layout the same as the autotools build's.
+        """
+        cmake = conans.CMake(self.settings, generator='Ninja')
+        defs = {
+            'CMAKE_INSTALL_PREFIX': self.package_folder,
+            'CMAKE_C_FLAGS': vars['CFLAGS'],
+            'CMAKE_SHARED_LINKER_FLAGS': vars['LDFLAGS'],
+            'CMAKE_EXE_LINKER_FLAGS': vars['LDFLAGS'],
+            # Name shared libraries on Mac with @rpath, as source() makes
+            # configure do.
+            'CMAKE_MACOSX_RPATH': 'ON',
+            # Stock zlib installs zlib.pc in share/pkgconfig by default.
+            'INSTALL_PKGCONFIG_DIR': os.path.join(self.package_folder, 'lib', 'pkgconfig'),
+            # zlib 1.2.11 asks for CMake 2.4.4, which CMake 4 refuses.
+            'CMAKE_POLICY_VERSION_MINIMUM': '3.5',
+            }
+        if self.options.backend == 'zlib-ng-compat':
+            defs['ZLIB_COMPAT'] = 'ON'
+            defs['ZLIB_ENABLE_TESTS'] = 'ON'
+            defs['BUILD_SHARED_LIBS'] = 'ON' if self.options.shared else 'OFF'
+            defs['CMAKE_INSTALL_LIBDIR'] = 'lib'
+        if 'AR' in vars:
+            defs['CMAKE_AR'] = vars['AR']
+            defs['CMAKE_RANLIB'] = vars['RANLIB']
+        if compiler_cache:
+            defs['CMAKE_C_COMPILER_LAUNCHER'] = compiler_cache
+        
+        self.output.info('Configuring')
+        with self._phase('configure'):
+            cmake.configure(self, defs=defs, source_dir=source_dir, build_dir=build_dir)
+        
+        self.output.info('Compiling')
+        with self._phase('compile'):
+            cmake.build(self, ['--', '-j%s' % (cpu_count)], build_dir=build_dir)
+    
+    def _cmake_flags(self, build_dir):
+        """
+        Reads the compiler and flags CMake settled on from its cache, under
+        the names configure uses.
+        """
+        cache = {}
+        with open(os.path.join(build_dir, 'CMakeCache.txt'), 'r') as input:
+            for line in input:
+                if line.startswith('#') or line.startswith('//'):
+                    continue
+                name, equals, value = line.partition('=')
+                if equals:
+                    cache[name.split(':')[0]] = value.strip()
+        cflags = [cache.get('CMAKE_C_FLAGS', ''), cache.get('CMAKE_C_FLAGS_%s' % (str(self.settings.build_type).upper()), '')]
+        flags = collections.OrderedDict()
+        flags['CC'] = cache.get('CMAKE_C_COMPILER', '')
+        flags['CFLAGS'] = ' '.join(flag for flag in cflags if flag)
+        flags['LDFLAGS'] = cache.get('CMAKE_SHARED_LINKER_FLAGS', '')
+        return flags
+    
+    def _contrib_targets(self):
+        """
+        The contrib/Makefile targets the options ask for: minizip and pgzip,
+        and the zlibbuf Python extension.
+        """
+        targets = []
+        if self.options.contrib:
+            targets.append('contrib')
+        if self.options.python != 'none':
+            targets.append('python')
+        return targets
+    
+    def _make_contrib(self, source_dir, build_dir, contrib_dir, targets, cpu_count):
+        """
+        Runs contrib/Makefile against the libz in build_dir.  minizip always
+        comes from the stock zlib sources, because zlib-ng does not ship it.
+        """
+        makefile = os.path.join(self.source_folder, 'contrib', 'Makefile')
+        minizip_source = os.path.join(self.source_folder, 'zlib', 'contrib', 'minizip')
+        python = self.options.python if self.options.python != 'none' else ''
+        # The CMake build leaves a shared libz next to the static one, which
+        # the linker would otherwise prefer.
+        zlib_libs = '-L%s -lz' % (build_dir) if self.options.shared else os.path.join(build_dir, 'libz.a')
+        self.run('make -j%s -f "%s" ZLIB_SOURCE="%s" ZLIB_BUILD="%s" ZLIB_LIBS="%s" MINIZIP_SOURCE="%s" SHARED=%s PYTHON="%s" prefix="%s" %s' % (cpu_count, makefile, source_dir, build_dir, zlib_libs, minizip_source, 1 if self.options.shared else 0, python, self.package_folder, ' '.join(targets)), cwd=contrib_dir)
+    
+    def _minigzip(self, build_dir):
+        """
+        The minigzip linked against the same kind of library as the package.
+        zlib's CMake build only links it against the shared library.
+        """
+        if self.options.shared and self.options.build_system == 'autotools':
+            return os.path.join(build_dir, 'minigzipsh')
+        return os.path.join(build_dir, 'minigzip')
+    
+    def _train_pgo(self, source_dir, build_dir):
+        """
+        Compress and decompress a training corpus with the instrumented
+        minigzip at a fast, the default, and the best compression level.
+        The bundled corpus is zlib's own sources and documentation plus the
+        freshly built library, which covers both text and binary input.
+        Passing `--scope ALL:pgoCorpus=<path>` adds a file or directory of
+        your own data, at the cost of the profile depending on that data.
+        """
+        minigzip = self._minigzip(build_dir)
+        if not os.path.isfile(minigzip):
+            self.output.warn('%s was not built, so training with the test suite instead.' % (minigzip))
+            self.run('make check', cwd=build_dir)
+            return
+        
+        corpus = []
+        for pattern in ['*.c', '*.h', 'ChangeLog', 'FAQ', 'README', 'doc/*.txt']:
+            corpus.extend(sorted(glob.glob(os.path.join(source_dir, pattern))))
+        corpus.extend(sorted(glob.glob(os.path.join(build_dir, 'libz.*'))))
+        if self.scope.pgoCorpus:
+            user_corpus = os.path.realpath(os.path.expanduser(str(self.scope.pgoCorpus)))
+            if os.path.isdir(user_corpus):
+                for root, _, files in os.walk(user_corpus):
+                    corpus.extend(os.path.join(root, name) for name in sorted(files))
+            else:
+                corpus.append(user_corpus)
+        corpus = [path for path in corpus if os.path.isfile(path)]
+        
+        corpus_list = os.path.join(build_dir, 'pgo-corpus.txt')
+        with open(corpus_list, 'w') as output:
+            for path in corpus:
+                output.write('%s\n' % (path))
+        
+        self.output.info('Training on %s files' % (len(corpus)))
+        library_path = 'DYLD_LIBRARY_PATH' if conans.tools.os_info.is_macos else 'LD_LIBRARY_PATH'
+        with conans.tools.environment_append({library_path: build_dir}):
+            self.run('while read f; do for level in 1 6 9; do "%s" -$level -c "$f" > pgo-train.gz && "%s" -d -c pgo-train.gz > /dev/null || exit 1; done; done < "%s"' % (minigzip, minigzip, corpus_list), cwd=build_dir)
+        os.remove(os.path.join(build_dir, 'pgo-train.gz'))
+        os.remove(corpus_list)
+    
+    @staticmethod
+    def _make_variables(makefile, names):
+        """
+        Reads the values configure assigned to the named variables in a
+        generated Makefile.
+        """
+        values = collections.OrderedDict()
+        with open(makefile, 'r') as input:
+            for line in input:
+                name, equals, value = line.partition('=')
+                name = name.strip()
+                if equals and name in names and name not in values:
+                    values[name] = value.strip()
+        return values
+    
+    def _benchmark_minigzip(self, build_dir):
+        """
+        Times the freshly built minigzip compressing and decompressing stock
+        zlib's sources and documentation at a fast, the default, and the best
+        compression level.  Both backends use the same corpus, so the numbers
+        compare across builds.  Each figure is the best of three runs and
+        includes starting the process, so it is only good for comparing with
+        other builds of this recipe.  Returns an empty list if minigzip was
+        not built or cannot run.
+        """
+        minigzip = self._minigzip(build_dir)
+        if not os.path.isfile(minigzip):
+            self.output.warn('%s was not built, so skipping the benchmark.' % (minigzip))
+            return []
+        
+        corpus = os.path.join(build_dir, 'benchmark-corpus')
+        compressed = '%s.gz' % (corpus)
+        with open(corpus, 'wb') as output:
+            for pattern in ['*.c', '*.h', 'ChangeLog', 'FAQ', 'README', 'doc/*.txt']:
+                for path in sorted(glob.glob(os.path.join(self.source_folder, 'zlib', pattern))):
+                    with open(path, 'rb') as input:
+                        shutil.copyfileobj(input, output)
+        corpus_bytes = os.path.getsize(corpus)
+        
+        env = dict(os.environ)
+        env['DYLD_LIBRARY_PATH' if conans.tools.os_info.is_macos else 'LD_LIBRARY_PATH'] = build_dir
+        def best_of_three(arguments, output_path):
+            seconds = []
+            for _ in range(3):
+                with open(output_path, 'wb') as output:
+                    start = time.time()
+                    subprocess.check_call([minigzip] + arguments, stdout=output, env=env)
+                    seconds.append(time.time() - start)
+            return min(seconds)
+        
+        results = []
+        try:
+            for level in (1, 6, 9):
+                compress_seconds = best_of_three(['-%s' % (level), '-c', corpus], compressed)
+                decompress_seconds = best_of_three(['-d', '-c', compressed], os.devnull)
+                result = {
+                    'level': level,
+                    'input_bytes': corpus_bytes,
+                    'output_bytes': os.path.getsize(compressed),
+                    'compress_mb_per_s': round(corpus_bytes / compress_seconds / 1e6, 2),
+                    'decompress_mb_per_s': round(corpus_bytes / decompress_seconds / 1e6, 2),
+                    }
+                self.output.info('Level %s: %s to %s bytes, compress %.1f MB/s, decompress %.1f MB/s' % (level, result['input_bytes'], result['output_bytes'], result['compress_mb_per_s'], result['decompress_mb_per_s']))
+                results.append(result)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.output.warn('Unable to run the benchmark: %s' % (e))
+            results = []
+        finally:
+            for path in [corpus, compressed]:
+                if os.path.exists(path):
+                    os.remove(path)
+        return results
     
     def package(self):
 #         conan_storage_path = conans.client.client_cache.ConanClientConfigParser.storage_path
@@ -130,21 +984,34 @@ class ZlibConan(conans.ConanFile):
         # hard-coded paths where the library was installed.
         # We need to remove those and replace them with a placeholder that
         # Conan can fill in on any other machine as appropriate.
+        pkgconfig_files = []
         for libdir in ['lib', 'share']:
             pkgconfig_dir = os.path.join(self.package_folder, libdir, 'pkgconfig')
             if os.path.isdir(pkgconfig_dir):
                 pkgconfig_pattern = os.path.join(pkgconfig_dir, '*.pc')
-                for pkgconfig_file in glob.iglob(pkgconfig_pattern):
-                    self.output.info('Stripping Conan storage directory (%s) from pkg-config file %s' % (conan_storage_path, pkgconfig_file))
-                    _, tempname = tempfile.mkstemp()
-                    with open(tempname, 'w') as output:
-                        with open(pkgconfig_file, 'r') as input:
-                            # TODO: replace this with something pkg-config can expand automatically
-                            output.write('conan_storage_path=~/.conan/data\n')
-                            for line in input:
-                                output.write(line)
-                    shutil.move(tempname, pkgconfig_file)
-                    conans.tools.replace_in_file(pkgconfig_file, conan_storage_path, '${conan_storage_path}')
+                pkgconfig_files.extend(glob.iglob(pkgconfig_pattern))
+        # Each file is independent, so rewrite them all at once.
+        failures = []
+        def rewrite(pkgconfig_file):
+            try:
+                self._rewrite_pkgconfig_file(pkgconfig_file, conan_storage_path)
+            except Exception as e:
+                failures.append(e)
+        threads = [threading.Thread(target=rewrite, args=(pkgconfig_file,)) for pkgconfig_file in pkgconfig_files]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise failures[0]
+        
+        # Parsing the pkg-config files here means package_info() does not
+        # have to do it again for every consumer.
+        with open(os.path.join(self.package_folder, self.pkgconfig_metadata_name), 'w') as output:
+            json.dump(self._parse_pkgconfig_files(), output, indent=2, sort_keys=True)
+        
+        # The timing report written at the end of build().
+        self.copy('zlib_build_report.json')
         
         libdir = os.path.join(self.package_folder, 'lib')
         
@@ -155,6 +1022,182 @@ class ZlibConan(conans.ConanFile):
             for libtool_file in glob.iglob(os.path.join(libdir, '*.la')):
                 self.output.info('Deleting libtool metadata %s' % (libtool_file))
                 os.remove(libtool_file)
+        
+        # Clang's LTO archive holds only bitcode, so leave it out of the
+        # shared packages, which configure() insists on for those builds.
+        static_library = os.path.join(libdir, 'libz.a')
+        if self.options.optimize != 'none' and self.settings.compiler in ('clang', 'apple-clang') and os.path.isfile(static_library):
+            self.output.info('Deleting LLVM bitcode archive %s' % (static_library))
+            os.remove(static_library)
+        
+        # With no_copy_source, the first call to package() has no build
+        # report yet.  The second call rewrites the manifest with it.
+        with open(os.path.join(self.package_folder, self.manifest_name), 'w') as output:
+            json.dump(self._manifest(), output, indent=2, sort_keys=True)
+    
+    def _manifest(self):
+        """
+        Describes what this package contains, so size and speed can be
+        tracked across recipe changes from the package alone.  This is the
+        settings and options, the build phases, flags and benchmark results
+        from the build report, and the size and exported symbol count of
+        each zlib library.
+        """
+        report = {}
+        report_file = os.path.join(self.package_folder, 'zlib_build_report.json')
+        if os.path.isfile(report_file):
+            with open(report_file, 'r') as input:
+                report = json.load(input)
+        
+        libraries = {}
+        for pattern in ['libz.a', 'libz.so*', 'libz.*dylib']:
+            for library in glob.glob(os.path.join(self.package_folder, 'lib', pattern)):
+                if not os.path.islink(library):
+                    libraries[os.path.basename(library)] = {
+                        'bytes': os.path.getsize(library),
+                        'exported_symbols': self._count_exported_symbols(library),
+                        }
+        
+        return {
+            'settings': {
+                'os': str(self.settings.os),
+                'compiler': str(self.settings.compiler),
+                'compiler.version': str(self.settings.compiler.version),
+                'build_type': str(self.settings.build_type),
+                'arch': str(self.settings.arch),
+                },
+            'options': dict((name, str(getattr(self.options, name))) for name in ZlibConan.options),
+            'wall_seconds': report.get('wall_seconds'),
+            'phases': report.get('phases', []),
+            'flags': report.get('flags', {}),
+            'benchmarks': report.get('benchmarks', []),
+            'libraries': libraries,
+            }
+    
+    def _count_exported_symbols(self, library):
+        """
+        Counts the symbols a library exports, not counting symbol versions.
+        For a shared library that is its dynamic symbol table.  For an
+        archive it is the global symbols its objects define with default or
+        protected visibility, which are the ones a shared library linked
+        from it would export; hidden ones are left out.  Returns None if the
+        library cannot be read.
+        """
+        if library.endswith('.a') and self.settings.os == 'Macos':
+            # nm -m marks hidden symbols as private external.
+            command = ['nm', '-g', '-U', '-m', library]
+        elif library.endswith('.a'):
+            # nm does not show visibility, readelf does.
+            command = ['readelf', '--symbols', '--wide', library]
+        elif library.endswith('.dylib'):
+            command = ['nm', '-g', '-U', library]
+        else:
+            command = ['nm', '-D', '--defined-only', library]
+        try:
+            symbols = subprocess.check_output(command, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.output.warn('Unable to list the symbols in %s: %s' % (library, e))
+            return None
+        count = 0
+        for line in symbols.decode('utf-8', 'replace').splitlines():
+            fields = line.split()
+            if command[0] == 'readelf':
+                # Num: Value Size Type Bind Vis Ndx Name, for each object.
+                # GCC's fat LTO objects also define marker symbols.
+                if len(fields) >= 8 and fields[0].endswith(':') and fields[0][:-1].isdigit() and fields[4] in ('GLOBAL', 'WEAK') and fields[5] in ('DEFAULT', 'PROTECTED') and fields[6] != 'UND' and not fields[-1].startswith('__gnu_lto_'):
+                    count += 1
+            elif '-m' in command:
+                if 'external' in fields and 'private' not in fields:
+                    count += 1
+            elif len(fields) == 3 and fields[1].isupper() and fields[1] != 'A':
+                count += 1
+        return count
+    
+    def _rewrite_pkgconfig_file(self, pkgconfig_file, conan_storage_path):
+        """
+        Prepends the conan_storage_path variable to a pkg-config file and
+        replaces the storage directory with a reference to it, streaming the
+        file through once.  The result goes to a temporary file next to the
+        original which is then renamed over it, so readers only ever see the
+        old file or the complete new one.
+        """
+        with open(pkgconfig_file, 'r') as input:
+            # With no_copy_source, Conan calls package() twice.  Only
+            # rewrite each file the first time.
+            if input.readline().startswith('conan_storage_path='):
+                return
+        self.output.info('Stripping Conan storage directory (%s) from pkg-config file %s' % (conan_storage_path, pkgconfig_file))
+        
+        found = False
+        fd, tempname = tempfile.mkstemp(dir=os.path.dirname(pkgconfig_file), prefix='.%s.' % (os.path.basename(pkgconfig_file)))
+        try:
+            with os.fdopen(fd, 'w') as output:
+                with open(pkgconfig_file, 'r') as input:
+                    # TODO: replace this with something pkg-config can expand automatically
+                    output.write('conan_storage_path=~/.conan/data\n')
+                    for line in input:
+                        if conan_storage_path in line:
+                            found = True
+                            line = line.replace(conan_storage_path, '${conan_storage_path}')
+                        output.write(line)
+            if not found:
+                raise conans.errors.ConanException('Conan storage directory %s not found in pkg-config file %s' % (conan_storage_path, pkgconfig_file))
+            shutil.copymode(pkgconfig_file, tempname)
+            # Windows cannot rename over an existing file.
+            if os.name == 'nt':
+                os.remove(pkgconfig_file)
+            os.rename(tempname, pkgconfig_file)
+        except:
+            if os.path.exists(tempname):
+                os.remove(tempname)
+            raise
+    
+    def _parse_pkgconfig_files(self):
+        """
+        Collects the libraries, preprocessor definitions, compiler flags and
+        linker flags from zlib.pc, in the order they first appear.  Include
+        and library paths are skipped, because Conan supplies its own.
+        minizip.pc is left alone, so that consumers only get libminizip and
+        its headers when they ask for them.
+        """
+        pkgconfig_dirs = []
+        libs = collections.OrderedDict()
+        defines = collections.OrderedDict()
+        cflags = collections.OrderedDict()
+        linkflags = collections.OrderedDict()
+        for libdir in ['lib', 'share']:
+            pkgconfig_dir = os.path.join(self.package_folder, libdir, 'pkgconfig')
+            if os.path.isdir(pkgconfig_dir):
+                pkgconfig_dirs.append(os.path.join(libdir, 'pkgconfig'))
+                pkgconfig_file = os.path.join(pkgconfig_dir, 'zlib.pc')
+                if os.path.isfile(pkgconfig_file):
+                    with open(pkgconfig_file, 'r') as input:
+                        for line in input:
+                            if line.startswith('Libs:'):
+                                for ele in line[5:].split():
+                                    if ele.startswith('-L'):
+                                        pass
+                                    elif ele.startswith('-l'):
+                                        libs[ele[2:]] = None
+                                    elif ele.startswith('-D'):
+                                        defines[ele[2:]] = None
+                                    else:
+                                        linkflags[ele] = None
+                            elif line.startswith('Cflags:'):
+                                for ele in line[7:].split():
+                                    if ele.startswith('-I'):
+                                        pass
+                                    elif ele.startswith('-D'):
+                                        defines[ele[2:]] = None
+                                    else:
+                                        cflags[ele] = None
+        return {
+            'pkgconfig_dirs': pkgconfig_dirs,
+            'libs': list(libs),
+            'defines': list(defines),
+            'cflags': list(cflags),
+            'linkflags': list(linkflags),
+            }
     
     def package_info(self):
         self.cpp_info.includedirs = ['include']  # Ordered list of include paths
@@ -168,50 +1211,62 @@ class ZlibConan(conans.ConanFile):
         self.cpp_info.sharedlinkflags = []  # linker flags
         self.cpp_info.exelinkflags = []  # linker flags
         
+        # package() parses the pkg-config files once and caches the result,
+        # so consumers only have to read a single small file.
+        metadata_file = os.path.join(self.package_folder, self.pkgconfig_metadata_name)
+        if os.path.isfile(metadata_file):
+            with open(metadata_file, 'r') as input:
+                metadata = json.load(input)
+        else:
+            metadata = self._parse_pkgconfig_files()
+        
         # pkg_config_path is a custom variable we add to the existing Conan env_info
-        self.env_info.PKG_CONFIG_PATH = []
-        for libdir in ['lib', 'share']:
-            pkgconfig_dir = os.path.join(self.package_folder, libdir, 'pkgconfig')
-            if os.path.isdir(pkgconfig_dir):
-                self.env_info.PKG_CONFIG_PATH.append(pkgconfig_dir)
-                pkgconfig_pattern = os.path.join(pkgconfig_dir, '*.pc')
-                for pkgconfig_file in glob.iglob(pkgconfig_pattern):
-                    with open(pkgconfig_file, 'r') as input:
-                        for line in input:
-                            if str(line).startswith('Libs:'):
-                                line = line[5:]
-                                for ele in line.split():
-                                    if str(ele).startswith('-L'):
-                                        pass
-                                    elif str(ele).startswith('-l'):
-                                        library = ele[2:]
-                                        if not library in self.cpp_info.libs:
-                                            self.cpp_info.libs.append(library)
-                                    elif str(ele).startswith('-D'):
-                                        define = ele[2:]
-                                        if not define in self.cpp_info.defines:
-                                            self.cpp_info.defines.append(define)
-                                    else:
-                                        flag = ele
-                                        if not flag in self.cpp_info.sharedlinkflags:
-                                            self.cpp_info.sharedlinkflags.append(flag)
-                                        if not flag in self.cpp_info.exelinkflags:
-                                            self.cpp_info.exelinkflags.append(flag)
-                            elif str(line).startswith('Cflags:'):
-                                line = line[7:]
-                                for ele in line.split():
-                                    if str(ele).startswith('-I'):
-                                        pass
-                                    elif str(ele).startswith('-D'):
-                                        define = ele[2:]
-                                        if not define in self.cpp_info.defines:
-                                            self.cpp_info.defines.append(define)
-                                    else:
-                                        flag = ele
-                                        if not flag in self.cpp_info.cflags:
-                                            self.cpp_info.cflags.append(flag)
-                                        if not flag in self.cpp_info.cppflags:
-                                            self.cpp_info.cppflags.append(flag)
+        self.env_info.PKG_CONFIG_PATH = [os.path.join(self.package_folder, pkgconfig_dir) for pkgconfig_dir in metadata['pkgconfig_dirs']]
+        self.cpp_info.libs = list(metadata['libs'])
+        self.cpp_info.defines = list(metadata['defines'])
+        self.cpp_info.cflags = list(metadata['cflags'])
+        self.cpp_info.cppflags = list(metadata['cflags'])
+        self.cpp_info.sharedlinkflags = list(metadata['linkflags'])
+        self.cpp_info.exelinkflags = list(metadata['linkflags'])
+        
+        # MAX_MEM_LEVEL and MAX_WBITS are defined in zconf.h, so consumers
+        # see the values the library was built with.  deflateInit2() rejects
+        # a memLevel above MAX_MEM_LEVEL, so that one is enforced.  The
+        # window size checks in deflateInit2() and inflateInit2() use a
+        # literal 15, so MAX_WBITS only lets consumers agree with the
+        # default window deflateInit() and inflateInit() use.
+        # DEF_MEM_LEVEL and UNALIGNED_OK only affect zlib's own sources.
+        tuning_defines = self._tuning_defines()
+        for name in ('MAX_MEM_LEVEL', 'MAX_WBITS'):
+            value = tuning_defines.get(name)
+            if value is not None:
+                self.cpp_info.defines.append('%s=%s' % (name, value))
+        
+        # The library was compiled into one section per function, so
+        # consumers that link it statically can drop whatever they do not use.
+        if self.options.gc_sections:
+            self.cpp_info.sharedlinkflags.append(self._gc_sections_link_flag())
+            self.cpp_info.exelinkflags.append(self._gc_sections_link_flag())
+        
+        # Let consumers check that a CPU can run the instruction set this
+        # package was compiled for before they run anything linked to it.
+        self.user_info.march = self.options.march
+        
+        # Conan has no per-library components, and minizip's headers have
+        # names like zip.h that other libraries use too, so consumers of
+        # zlib do not get minizip unless they ask for it.  They include
+        # <minizip/zip.h> and link the library named in user_info, or use
+        # minizip.pc.  The command-line tools go on the PATH.
+        if self.options.contrib:
+            self.user_info.minizip_lib = 'minizip'
+            self.user_info.minizip_include_dir = os.path.join(self.package_folder, 'include', 'minizip')
+            self.cpp_info.bindirs = ['bin']
+            self.env_info.PATH.append(os.path.join(self.package_folder, 'bin'))
+        
+        # The zlibbuf extension module, for the interpreter it was built for.
+        if self.options.python != 'none':
+            self.env_info.PYTHONPATH.append(os.path.join(self.package_folder, 'lib', 'python'))
+            self.user_info.python = self.options.python
         
         for includedir in self.cpp_info.includedirs:
             self.output.info('%s include dir: %s' % (self.name, includedir))
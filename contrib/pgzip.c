@@ -0,0 +1,513 @@
+#include <errno.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+#include "zlib.h"
+
+
+/*
+ * pgzip: a block-parallel gzip compressor.
+ *
+ * The input is split into blocks which are compressed on several threads at
+ * once, each as a raw deflate stream primed with the last 32 KiB of the
+ * block before it, so the compression ratio stays close to plain gzip.
+ * Every block but the last ends with a sync flush, which leaves the
+ * compressed blocks byte-aligned and unterminated, so they concatenate into
+ * a single deflate stream.  The CRC-32s of the blocks are merged with
+ * crc32_combine().  The result is an ordinary gzip file that any gunzip can
+ * read.
+ *
+ * Decompression is inherently serial, so -d simply uses zlib's gz* API.
+ */
+
+#define DICTIONARY_SIZE 32768
+#define DEFAULT_BLOCK_KIB 128
+#define BLOCKS_PER_THREAD 4
+#define COPY_BUFFER_SIZE (128 * 1024)
+/* zlib's default memory level, unless it was built with a lower maximum. */
+#define MEM_LEVEL (MAX_MEM_LEVEL < 8 ? MAX_MEM_LEVEL : 8)
+
+
+struct settings {
+    int level;
+    int threads;
+    size_t block_size;
+    int decompress;
+    int to_stdout;
+    int force;
+    int keep;
+};
+
+struct block {
+    unsigned char *input;
+    size_t input_size;
+    const unsigned char *dictionary;
+    size_t dictionary_size;
+    unsigned char *output;
+    size_t output_size;
+    size_t output_capacity;
+    unsigned long crc;
+    int last;
+    int error;
+};
+
+struct batch {
+    struct block *blocks;
+    size_t count;
+    size_t next;
+    int level;
+    pthread_mutex_t lock;
+};
+
+
+static const char *program = "pgzip";
+
+
+static int compress_block(struct block *block, int level) {
+    z_stream stream;
+    int flush = block->last ? Z_FINISH : Z_SYNC_FLUSH;
+    size_t bound;
+    int ret;
+
+    memset(&stream, 0, sizeof(stream));
+    if (deflateInit2(&stream, level, Z_DEFLATED, -MAX_WBITS, MEM_LEVEL, Z_DEFAULT_STRATEGY) != Z_OK) {
+        return -1;
+    }
+    if (block->dictionary_size > 0 &&
+        deflateSetDictionary(&stream, block->dictionary, (uInt)block->dictionary_size) != Z_OK) {
+        deflateEnd(&stream);
+        return -1;
+    }
+
+    /* Leave room for the empty stored block a sync flush appends. */
+    bound = deflateBound(&stream, (uLong)block->input_size) + 16;
+    if (block->output_capacity < bound) {
+        unsigned char *output = realloc(block->output, bound);
+        if (output == NULL) {
+            deflateEnd(&stream);
+            return -1;
+        }
+        block->output = output;
+        block->output_capacity = bound;
+    }
+
+    block->output_size = 0;
+    stream.next_in = block->input;
+    stream.avail_in = (uInt)block->input_size;
+    for (;;) {
+        stream.next_out = block->output + block->output_size;
+        stream.avail_out = (uInt)(block->output_capacity - block->output_size);
+        ret = deflate(&stream, flush);
+        block->output_size = block->output_capacity - stream.avail_out;
+        if (ret == Z_STREAM_ERROR) {
+            deflateEnd(&stream);
+            return -1;
+        }
+        if (block->last ? ret == Z_STREAM_END : stream.avail_out != 0) {
+            break;
+        }
+        /* The bound should make this unreachable, but never truncate. */
+        {
+            size_t capacity = block->output_capacity * 2;
+            unsigned char *output = realloc(block->output, capacity);
+            if (output == NULL) {
+                deflateEnd(&stream);
+                return -1;
+            }
+            block->output = output;
+            block->output_capacity = capacity;
+        }
+    }
+    deflateEnd(&stream);
+
+    block->crc = crc32(crc32(0L, Z_NULL, 0), block->input, (uInt)block->input_size);
+    return 0;
+}
+
+
+static void *compress_worker(void *arg) {
+    struct batch *batch = arg;
+    for (;;) {
+        size_t index;
+        pthread_mutex_lock(&batch->lock);
+        index = batch->next++;
+        pthread_mutex_unlock(&batch->lock);
+        if (index >= batch->count) {
+            return NULL;
+        }
+        batch->blocks[index].error = compress_block(&batch->blocks[index], batch->level);
+    }
+}
+
+
+static int compress_batch(struct block *blocks, size_t count, const struct settings *settings) {
+    struct batch batch;
+    pthread_t *threads;
+    size_t thread_count = (size_t)settings->threads < count ? (size_t)settings->threads : count;
+    size_t started = 0;
+    size_t index;
+
+    batch.blocks = blocks;
+    batch.count = count;
+    batch.next = 0;
+    batch.level = settings->level;
+    pthread_mutex_init(&batch.lock, NULL);
+
+    /* The calling thread is one of the workers. */
+    threads = calloc(thread_count, sizeof(*threads));
+    if (threads == NULL) {
+        pthread_mutex_destroy(&batch.lock);
+        return -1;
+    }
+    for (index = 1; index < thread_count; ++index) {
+        if (pthread_create(&threads[started], NULL, compress_worker, &batch) != 0) {
+            break;
+        }
+        ++started;
+    }
+    compress_worker(&batch);
+    for (index = 0; index < started; ++index) {
+        pthread_join(threads[index], NULL);
+    }
+    free(threads);
+    pthread_mutex_destroy(&batch.lock);
+
+    for (index = 0; index < count; ++index) {
+        if (blocks[index].error) {
+            fprintf(stderr, "%s: out of memory compressing block\n", program);
+            return -1;
+        }
+    }
+    return 0;
+}
+
+
+static void put_le32(unsigned char *buffer, unsigned long value) {
+    buffer[0] = (unsigned char)(value & 0xff);
+    buffer[1] = (unsigned char)((value >> 8) & 0xff);
+    buffer[2] = (unsigned char)((value >> 16) & 0xff);
+    buffer[3] = (unsigned char)((value >> 24) & 0xff);
+}
+
+
+static int compress_stream(FILE *in, FILE *out, const struct settings *settings) {
+    size_t batch_size = (size_t)settings->threads * BLOCKS_PER_THREAD;
+    struct block *blocks = calloc(batch_size, sizeof(*blocks));
+    unsigned char *tail = malloc(DICTIONARY_SIZE);
+    size_t tail_size = 0;
+    unsigned char header[10] = {0x1f, 0x8b, Z_DEFLATED, 0, 0, 0, 0, 0, 0, 3};
+    unsigned char trailer[8];
+    unsigned long crc = crc32(0L, Z_NULL, 0);
+    unsigned long total = 0;
+    int last = 0;
+    int result = -1;
+    size_t index;
+
+    if (blocks == NULL || tail == NULL) {
+        fprintf(stderr, "%s: out of memory\n", program);
+        goto done;
+    }
+    for (index = 0; index < batch_size; ++index) {
+        blocks[index].input = malloc(settings->block_size);
+        if (blocks[index].input == NULL) {
+            fprintf(stderr, "%s: out of memory\n", program);
+            goto done;
+        }
+    }
+
+    /* Extra flags: 2 for maximum compression, 4 for fastest. */
+    header[8] = settings->level == 9 ? 2 : settings->level == 1 ? 4 : 0;
+    if (fwrite(header, 1, sizeof(header), out) != sizeof(header)) {
+        goto write_error;
+    }
+
+    while (!last) {
+        size_t count = 0;
+        while (count < batch_size && !last) {
+            struct block *block = &blocks[count];
+            int next;
+
+            block->input_size = fread(block->input, 1, settings->block_size, in);
+            if (ferror(in)) {
+                fprintf(stderr, "%s: read error: %s\n", program, strerror(errno));
+                goto done;
+            }
+            /* Only the last block may finish the deflate stream. */
+            next = getc(in);
+            if (next == EOF) {
+                if (ferror(in)) {
+                    fprintf(stderr, "%s: read error: %s\n", program, strerror(errno));
+                    goto done;
+                }
+                last = 1;
+            } else {
+                ungetc(next, in);
+            }
+            block->last = last;
+
+            if (count == 0) {
+                block->dictionary = tail;
+                block->dictionary_size = tail_size;
+            } else {
+                const struct block *previous = &blocks[count - 1];
+                block->dictionary_size = previous->input_size < DICTIONARY_SIZE ? previous->input_size : DICTIONARY_SIZE;
+                block->dictionary = previous->input + previous->input_size - block->dictionary_size;
+            }
+            ++count;
+        }
+
+        if (compress_batch(blocks, count, settings) != 0) {
+            goto done;
+        }
+
+        for (index = 0; index < count; ++index) {
+            const struct block *block = &blocks[index];
+            if (fwrite(block->output, 1, block->output_size, out) != block->output_size) {
+                goto write_error;
+            }
+            crc = crc32_combine(crc, block->crc, (z_off_t)block->input_size);
+            total = (total + (unsigned long)block->input_size) & 0xffffffffUL;
+        }
+
+        /* The input buffers are about to be reused, so keep the dictionary
+         * for the first block of the next batch. */
+        if (!last) {
+            const struct block *block = &blocks[count - 1];
+            tail_size = block->input_size < DICTIONARY_SIZE ? block->input_size : DICTIONARY_SIZE;
+            memcpy(tail, block->input + block->input_size - tail_size, tail_size);
+        }
+    }
+
+    put_le32(trailer, crc);
+    put_le32(trailer + 4, total);
+    if (fwrite(trailer, 1, sizeof(trailer), out) != sizeof(trailer) || fflush(out) != 0) {
+        goto write_error;
+    }
+    result = 0;
+    goto done;
+
+write_error:
+    fprintf(stderr, "%s: write error: %s\n", program, strerror(errno));
+done:
+    if (blocks != NULL) {
+        for (index = 0; index < batch_size; ++index) {
+            free(blocks[index].input);
+            free(blocks[index].output);
+        }
+    }
+    free(blocks);
+    free(tail);
+    return result;
+}
+
+
+static int decompress_stream(FILE *in, FILE *out) {
+    int fd = dup(fileno(in));
+    gzFile file;
+    unsigned char *buffer;
+    int result = 0;
+    int count;
+
+    if (fd < 0 || (file = gzdopen(fd, "rb")) == NULL) {
+        fprintf(stderr, "%s: %s\n", program, strerror(errno));
+        if (fd >= 0) {
+            close(fd);
+        }
+        return -1;
+    }
+    buffer = malloc(COPY_BUFFER_SIZE);
+    if (buffer == NULL) {
+        fprintf(stderr, "%s: out of memory\n", program);
+        gzclose(file);
+        return -1;
+    }
+    gzbuffer(file, COPY_BUFFER_SIZE);
+    while ((count = gzread(file, buffer, COPY_BUFFER_SIZE)) > 0) {
+        if (fwrite(buffer, 1, (size_t)count, out) != (size_t)count) {
+            fprintf(stderr, "%s: write error: %s\n", program, strerror(errno));
+            result = -1;
+            break;
+        }
+    }
+    if (count < 0) {
+        int error;
+        fprintf(stderr, "%s: %s\n", program, gzerror(file, &error));
+        result = -1;
+    }
+    free(buffer);
+    gzclose(file);
+    if (result == 0 && fflush(out) != 0) {
+        fprintf(stderr, "%s: write error: %s\n", program, strerror(errno));
+        result = -1;
+    }
+    return result;
+}
+
+
+static int process_stream(FILE *in, FILE *out, const struct settings *settings) {
+    return settings->decompress ? decompress_stream(in, out) : compress_stream(in, out, settings);
+}
+
+
+static int process_file(const char *path, const struct settings *settings) {
+    size_t length = strlen(path);
+    char *output_path = NULL;
+    FILE *in;
+    FILE *out;
+    int result;
+
+    in = fopen(path, "rb");
+    if (in == NULL) {
+        fprintf(stderr, "%s: %s: %s\n", program, path, strerror(errno));
+        return -1;
+    }
+    if (settings->to_stdout) {
+        result = process_stream(in, stdout, settings);
+        fclose(in);
+        return result;
+    }
+
+    if (settings->decompress) {
+        if (length <= 3 || strcmp(path + length - 3, ".gz") != 0) {
+            fprintf(stderr, "%s: %s: unknown suffix, ignored\n", program, path);
+            fclose(in);
+            return -1;
+        }
+        output_path = malloc(length - 2);
+        if (output_path != NULL) {
+            memcpy(output_path, path, length - 3);
+            output_path[length - 3] = '\0';
+        }
+    } else {
+        output_path = malloc(length + 4);
+        if (output_path != NULL) {
+            memcpy(output_path, path, length);
+            memcpy(output_path + length, ".gz", 4);
+        }
+    }
+    if (output_path == NULL) {
+        fprintf(stderr, "%s: out of memory\n", program);
+        fclose(in);
+        return -1;
+    }
+    if (!settings->force && access(output_path, F_OK) == 0) {
+        fprintf(stderr, "%s: %s already exists, use -f to overwrite\n", program, output_path);
+        free(output_path);
+        fclose(in);
+        return -1;
+    }
+
+    out = fopen(output_path, "wb");
+    if (out == NULL) {
+        fprintf(stderr, "%s: %s: %s\n", program, output_path, strerror(errno));
+        free(output_path);
+        fclose(in);
+        return -1;
+    }
+    result = process_stream(in, out, settings);
+    if (fclose(out) != 0 && result == 0) {
+        fprintf(stderr, "%s: %s: %s\n", program, output_path, strerror(errno));
+        result = -1;
+    }
+    fclose(in);
+
+    if (result != 0) {
+        remove(output_path);
+    } else if (!settings->keep) {
+        remove(path);
+    }
+    free(output_path);
+    return result;
+}
+
+
+static void usage(void) {
+    fprintf(stderr,
+        "usage: %s [-1..-9] [-c] [-d] [-f] [-k] [-p THREADS] [-b KIB] [FILE...]\n"
+        "  -1..-9      compression level (default 6)\n"
+        "  -c          write to standard output and keep the input files\n"
+        "  -d          decompress\n"
+        "  -f          overwrite existing output files\n"
+        "  -k          keep the input files\n"
+        "  -p THREADS  number of compression threads (default: one per CPU)\n"
+        "  -b KIB      block size in KiB, at least 32 (default %d)\n"
+        "With no FILE, read standard input and write standard output.\n",
+        program, DEFAULT_BLOCK_KIB);
+}
+
+
+int main(int argc, char **argv) {
+    struct settings settings;
+    long cpus = sysconf(_SC_NPROCESSORS_ONLN);
+    int option;
+    int failures = 0;
+    int index;
+
+    settings.level = Z_DEFAULT_COMPRESSION == -1 ? 6 : Z_DEFAULT_COMPRESSION;
+    settings.threads = cpus > 0 ? (int)cpus : 1;
+    settings.block_size = (size_t)DEFAULT_BLOCK_KIB * 1024;
+    settings.decompress = 0;
+    settings.to_stdout = 0;
+    settings.force = 0;
+    settings.keep = 0;
+
+    while ((option = getopt(argc, argv, "123456789cdfkp:b:h")) != -1) {
+        switch (option) {
+        case '1': case '2': case '3': case '4': case '5':
+        case '6': case '7': case '8': case '9':
+            settings.level = option - '0';
+            break;
+        case 'c':
+            settings.to_stdout = 1;
+            break;
+        case 'd':
+            settings.decompress = 1;
+            break;
+        case 'f':
+            settings.force = 1;
+            break;
+        case 'k':
+            settings.keep = 1;
+            break;
+        case 'p':
+            settings.threads = atoi(optarg);
+            if (settings.threads < 1) {
+                fprintf(stderr, "%s: -p needs at least one thread\n", program);
+                return 2;
+            }
+            break;
+        case 'b': {
+            long kib = atol(optarg);
+            if (kib < DICTIONARY_SIZE / 1024 || kib > 1024L * 1024L) {
+                fprintf(stderr, "%s: -b must be between %d and %ld KiB\n", program, DICTIONARY_SIZE / 1024, 1024L * 1024L);
+                return 2;
+            }
+            settings.block_size = (size_t)kib * 1024;
+            break;
+        }
+        case 'h':
+            usage();
+            return 0;
+        default:
+            usage();
+            return 2;
+        }
+    }
+
+    if (optind == argc) {
+        if (!settings.decompress && !settings.force && isatty(fileno(stdout))) {
+            fprintf(stderr, "%s: refusing to write compressed data to a terminal, use -f to force\n", program);
+            return 1;
+        }
+        return process_stream(stdin, stdout, &settings) == 0 ? 0 : 1;
+    }
+    for (index = optind; index < argc; ++index) {
+        if (process_file(argv[index], &settings) != 0) {
+            ++failures;
+        }
+    }
+    return failures == 0 ? 0 : 1;
+}
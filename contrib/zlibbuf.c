@@ -0,0 +1,455 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <limits.h>
+
+#include "zlib.h"
+
+
+/*
+ * zlibbuf: a Python 3 extension module exposing the zlib it was built with.
+ *
+ * Every function takes its input through the buffer protocol, so bytes,
+ * bytearray, memoryview slices, mmap objects, array.array and contiguous
+ * NumPy arrays are all read in place without a copy.  compress_into() and
+ * decompress_into() write straight into a caller-provided writable buffer,
+ * so a service can reuse one output buffer instead of allocating a new
+ * bytes object per call.  The GIL is released while zlib runs, so calls
+ * from a thread pool run on as many cores as there are threads.
+ */
+
+/* Below this size, releasing and reacquiring the GIL costs more than it saves. */
+#define RELEASE_GIL_MIN_SIZE (5 * 1024)
+#define DEFAULT_DECOMPRESS_SIZE (16 * 1024)
+
+/* zlib's own default, which it keeps in the private zutil.h. */
+#ifndef DEF_MEM_LEVEL
+#  if MAX_MEM_LEVEL >= 8
+#    define DEF_MEM_LEVEL 8
+#  else
+#    define DEF_MEM_LEVEL MAX_MEM_LEVEL
+#  endif
+#endif
+
+
+static PyObject *ZlibbufError;
+
+
+static uInt chunk(Py_ssize_t remaining) {
+    return remaining > (Py_ssize_t)UINT_MAX ? UINT_MAX : (uInt)remaining;
+}
+
+
+static void set_zlib_error(const char *operation, int err, const z_stream *stream) {
+    const char *message = stream != NULL && stream->msg != NULL ? stream->msg : zError(err);
+    PyErr_Format(ZlibbufError, "Error %d while %s: %s", err, operation, message);
+}
+
+
+/*
+ * Runs deflate with Z_FINISH until the stream ends or the output is full,
+ * feeding input and output to zlib in pieces that fit in a uInt.  Returns
+ * Z_STREAM_END on success.
+ */
+static int deflate_buffer(z_stream *stream, const Py_buffer *input, unsigned char *output, Py_ssize_t output_size, Py_ssize_t *written) {
+    Py_ssize_t consumed = 0;
+    int err;
+
+    *written = 0;
+    do {
+        uInt avail_in = chunk(input->len - consumed);
+        uInt avail_out = chunk(output_size - *written);
+        stream->next_in = (Bytef *)input->buf + consumed;
+        stream->avail_in = avail_in;
+        stream->next_out = output + *written;
+        stream->avail_out = avail_out;
+        err = deflate(stream, consumed + avail_in == input->len ? Z_FINISH : Z_NO_FLUSH);
+        consumed += avail_in - stream->avail_in;
+        *written += avail_out - stream->avail_out;
+    } while (err == Z_OK && *written < output_size);
+    return err;
+}
+
+
+/*
+ * Runs inflate until the stream ends or no more progress is possible, which
+ * is reported as Z_BUF_ERROR.  The caller tells a full output buffer apart
+ * from truncated input by comparing *written with output_size.
+ */
+static int inflate_buffer(z_stream *stream, const Py_buffer *input, Py_ssize_t *consumed, unsigned char *output, Py_ssize_t output_size, Py_ssize_t *written) {
+    int err;
+
+    do {
+        uInt avail_in = chunk(input->len - *consumed);
+        uInt avail_out = chunk(output_size - *written);
+        stream->next_in = (Bytef *)input->buf + *consumed;
+        stream->avail_in = avail_in;
+        stream->next_out = output + *written;
+        stream->avail_out = avail_out;
+        err = inflate(stream, Z_NO_FLUSH);
+        *consumed += avail_in - stream->avail_in;
+        *written += avail_out - stream->avail_out;
+    } while (err == Z_OK);
+    return err == Z_NEED_DICT ? Z_DATA_ERROR : err;
+}
+
+
+static int init_deflate(z_stream *stream, int level, int wbits) {
+    int err;
+    memset(stream, 0, sizeof(*stream));
+    err = deflateInit2(stream, level, Z_DEFLATED, wbits, DEF_MEM_LEVEL, Z_DEFAULT_STRATEGY);
+    if (err == Z_STREAM_ERROR) {
+        PyErr_SetString(PyExc_ValueError, "invalid compression level or wbits");
+        return 0;
+    }
+    if (err != Z_OK) {
+        if (err == Z_MEM_ERROR) {
+            PyErr_NoMemory();
+        } else {
+            set_zlib_error("initializing compression", err, stream);
+        }
+        return 0;
+    }
+    return 1;
+}
+
+
+static int init_inflate(z_stream *stream, int wbits) {
+    int err;
+    memset(stream, 0, sizeof(*stream));
+    err = inflateInit2(stream, wbits);
+    if (err == Z_STREAM_ERROR) {
+        PyErr_SetString(PyExc_ValueError, "invalid wbits");
+        return 0;
+    }
+    if (err != Z_OK) {
+        if (err == Z_MEM_ERROR) {
+            PyErr_NoMemory();
+        } else {
+            set_zlib_error("initializing decompression", err, stream);
+        }
+        return 0;
+    }
+    return 1;
+}
+
+
+PyDoc_STRVAR(compress_bound__doc__,
+"compress_bound(length, level=-1, wbits=15) -> int\n"
+"\n"
+"Return the most bytes compress() can produce for length bytes of input,\n"
+"for sizing a compress_into() buffer.");
+
+static PyObject *zlibbuf_compress_bound(PyObject *module, PyObject *args, PyObject *kwargs) {
+    static char *keywords[] = {"length", "level", "wbits", NULL};
+    Py_ssize_t length;
+    int level = Z_DEFAULT_COMPRESSION;
+    int wbits = MAX_WBITS;
+    z_stream stream;
+    uLong bound;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "n|ii:compress_bound", keywords, &length, &level, &wbits)) {
+        return NULL;
+    }
+    if (length < 0) {
+        PyErr_SetString(PyExc_ValueError, "length must not be negative");
+        return NULL;
+    }
+    if (!init_deflate(&stream, level, wbits)) {
+        return NULL;
+    }
+    bound = deflateBound(&stream, (uLong)length);
+    deflateEnd(&stream);
+    return PyLong_FromUnsignedLong(bound);
+}
+
+
+PyDoc_STRVAR(compress__doc__,
+"compress(data, level=-1, wbits=15) -> bytes\n"
+"\n"
+"Compress any contiguous buffer.  wbits selects the format as for the\n"
+"zlib module: 9 to 15 for zlib, -9 to -15 for raw deflate, 25 to 31 for gzip.");
+
+static PyObject *zlibbuf_compress(PyObject *module, PyObject *args, PyObject *kwargs) {
+    static char *keywords[] = {"data", "level", "wbits", NULL};
+    Py_buffer input;
+    int level = Z_DEFAULT_COMPRESSION;
+    int wbits = MAX_WBITS;
+    z_stream stream;
+    PyObject *result = NULL;
+    Py_ssize_t written;
+    int err;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*|ii:compress", keywords, &input, &level, &wbits)) {
+        return NULL;
+    }
+    if (!init_deflate(&stream, level, wbits)) {
+        PyBuffer_Release(&input);
+        return NULL;
+    }
+    result = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)deflateBound(&stream, (uLong)input.len));
+    if (result != NULL) {
+        /* Nothing else can see the new bytes object yet. */
+        Py_BEGIN_ALLOW_THREADS
+        err = deflate_buffer(&stream, &input, (unsigned char *)PyBytes_AS_STRING(result), PyBytes_GET_SIZE(result), &written);
+        Py_END_ALLOW_THREADS
+        if (err != Z_STREAM_END) {
+            set_zlib_error("compressing data", err, &stream);
+            Py_CLEAR(result);
+        } else {
+            _PyBytes_Resize(&result, written);
+        }
+    }
+    deflateEnd(&stream);
+    PyBuffer_Release(&input);
+    return result;
+}
+
+
+PyDoc_STRVAR(compress_into__doc__,
+"compress_into(data, output, level=-1, wbits=15) -> int\n"
+"\n"
+"Compress data into the writable buffer output and return the number of\n"
+"bytes written.  Raises ValueError if output is too small; a buffer of\n"
+"compress_bound(len(data)) bytes is always large enough.");
+
+static PyObject *zlibbuf_compress_into(PyObject *module, PyObject *args, PyObject *kwargs) {
+    static char *keywords[] = {"data", "output", "level", "wbits", NULL};
+    Py_buffer input;
+    Py_buffer output;
+    int level = Z_DEFAULT_COMPRESSION;
+    int wbits = MAX_WBITS;
+    z_stream stream;
+    PyObject *result = NULL;
+    Py_ssize_t written;
+    int err;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*w*|ii:compress_into", keywords, &input, &output, &level, &wbits)) {
+        return NULL;
+    }
+    if (init_deflate(&stream, level, wbits)) {
+        Py_BEGIN_ALLOW_THREADS
+        err = deflate_buffer(&stream, &input, output.buf, output.len, &written);
+        Py_END_ALLOW_THREADS
+        if (err == Z_STREAM_END) {
+            result = PyLong_FromSsize_t(written);
+        } else if (written == output.len) {
+            PyErr_Format(PyExc_ValueError, "output buffer of %zd bytes is too small", output.len);
+        } else {
+            set_zlib_error("compressing data", err, &stream);
+        }
+        deflateEnd(&stream);
+    }
+    PyBuffer_Release(&output);
+    PyBuffer_Release(&input);
+    return result;
+}
+
+
+PyDoc_STRVAR(decompress__doc__,
+"decompress(data, wbits=15, bufsize=16384) -> bytes\n"
+"\n"
+"Decompress any contiguous buffer.  bufsize is the initial output size;\n"
+"it doubles as needed.  wbits can also be 40 to 47 to detect zlib or gzip\n"
+"automatically.");
+
+static PyObject *zlibbuf_decompress(PyObject *module, PyObject *args, PyObject *kwargs) {
+    static char *keywords[] = {"data", "wbits", "bufsize", NULL};
+    Py_buffer input;
+    int wbits = MAX_WBITS;
+    Py_ssize_t size = DEFAULT_DECOMPRESS_SIZE;
+    z_stream stream;
+    PyObject *result;
+    Py_ssize_t consumed = 0;
+    Py_ssize_t written = 0;
+    int err;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*|in:decompress", keywords, &input, &wbits, &size)) {
+        return NULL;
+    }
+    if (size <= 0) {
+        PyErr_SetString(PyExc_ValueError, "bufsize must be greater than zero");
+        PyBuffer_Release(&input);
+        return NULL;
+    }
+    if (!init_inflate(&stream, wbits)) {
+        PyBuffer_Release(&input);
+        return NULL;
+    }
+    result = PyBytes_FromStringAndSize(NULL, size);
+    while (result != NULL) {
+        Py_BEGIN_ALLOW_THREADS
+        err = inflate_buffer(&stream, &input, &consumed, (unsigned char *)PyBytes_AS_STRING(result), size, &written);
+        Py_END_ALLOW_THREADS
+        if (err == Z_STREAM_END) {
+            _PyBytes_Resize(&result, written);
+            break;
+        }
+        if (err == Z_BUF_ERROR && written == size) {
+            if (size > PY_SSIZE_T_MAX / 2) {
+                PyErr_NoMemory();
+                Py_CLEAR(result);
+                break;
+            }
+            size *= 2;
+            _PyBytes_Resize(&result, size);
+            continue;
+        }
+        if (err == Z_BUF_ERROR) {
+            PyErr_SetString(ZlibbufError, "Error -5 while decompressing data: incomplete or truncated stream");
+        } else {
+            set_zlib_error("decompressing data", err, &stream);
+        }
+        Py_CLEAR(result);
+    }
+    inflateEnd(&stream);
+    PyBuffer_Release(&input);
+    return result;
+}
+
+
+PyDoc_STRVAR(decompress_into__doc__,
+"decompress_into(data, output, wbits=15) -> int\n"
+"\n"
+"Decompress data into the writable buffer output and return the number of\n"
+"bytes written.  Raises ValueError if output is too small.");
+
+static PyObject *zlibbuf_decompress_into(PyObject *module, PyObject *args, PyObject *kwargs) {
+    static char *keywords[] = {"data", "output", "wbits", NULL};
+    Py_buffer input;
+    Py_buffer output;
+    int wbits = MAX_WBITS;
+    z_stream stream;
+    PyObject *result = NULL;
+    Py_ssize_t consumed = 0;
+    Py_ssize_t written = 0;
+    int err;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*w*|i:decompress_into", keywords, &input, &output, &wbits)) {
+        return NULL;
+    }
+    if (init_inflate(&stream, wbits)) {
+        Py_BEGIN_ALLOW_THREADS
+        err = inflate_buffer(&stream, &input, &consumed, output.buf, output.len, &written);
+        Py_END_ALLOW_THREADS
+        if (err == Z_STREAM_END) {
+            result = PyLong_FromSsize_t(written);
+        } else if (err == Z_BUF_ERROR && written == output.len) {
+            PyErr_Format(PyExc_ValueError, "output buffer of %zd bytes is too small", output.len);
+        } else if (err == Z_BUF_ERROR) {
+            PyErr_SetString(ZlibbufError, "Error -5 while decompressing data: incomplete or truncated stream");
+        } else {
+            set_zlib_error("decompressing data", err, &stream);
+        }
+        inflateEnd(&stream);
+    }
+    PyBuffer_Release(&output);
+    PyBuffer_Release(&input);
+    return result;
+}
+
+
+typedef uLong (*checksum_function)(uLong, const Bytef *, uInt);
+
+static PyObject *checksum(PyObject *args, const char *format, checksum_function function, unsigned long initial) {
+    Py_buffer input;
+    unsigned long value = initial;
+    Py_ssize_t offset = 0;
+
+    if (!PyArg_ParseTuple(args, format, &input, &value)) {
+        return NULL;
+    }
+    value &= 0xffffffffUL;
+    if (input.len > RELEASE_GIL_MIN_SIZE) {
+        Py_BEGIN_ALLOW_THREADS
+        while (offset < input.len) {
+            uInt length = chunk(input.len - offset);
+            value = function(value, (const Bytef *)input.buf + offset, length);
+            offset += length;
+        }
+        Py_END_ALLOW_THREADS
+    } else if (input.len > 0) {
+        value = function(value, input.buf, (uInt)input.len);
+    }
+    PyBuffer_Release(&input);
+    return PyLong_FromUnsignedLong(value & 0xffffffffUL);
+}
+
+
+PyDoc_STRVAR(crc32__doc__,
+"crc32(data, value=0) -> int\n"
+"\n"
+"Compute a CRC-32 of any contiguous buffer, continuing from value.");
+
+static PyObject *zlibbuf_crc32(PyObject *module, PyObject *args) {
+    return checksum(args, "y*|k:crc32", crc32, 0);
+}
+
+
+PyDoc_STRVAR(adler32__doc__,
+"adler32(data, value=1) -> int\n"
+"\n"
+"Compute an Adler-32 of any contiguous buffer, continuing from value.");
+
+static PyObject *zlibbuf_adler32(PyObject *module, PyObject *args) {
+    return checksum(args, "y*|k:adler32", adler32, 1);
+}
+
+
+static PyMethodDef zlibbuf_methods[] = {
+    {"compress", (PyCFunction)(void (*)(void))zlibbuf_compress, METH_VARARGS | METH_KEYWORDS, compress__doc__},
+    {"compress_into", (PyCFunction)(void (*)(void))zlibbuf_compress_into, METH_VARARGS | METH_KEYWORDS, compress_into__doc__},
+    {"compress_bound", (PyCFunction)(void (*)(void))zlibbuf_compress_bound, METH_VARARGS | METH_KEYWORDS, compress_bound__doc__},
+    {"decompress", (PyCFunction)(void (*)(void))zlibbuf_decompress, METH_VARARGS | METH_KEYWORDS, decompress__doc__},
+    {"decompress_into", (PyCFunction)(void (*)(void))zlibbuf_decompress_into, METH_VARARGS | METH_KEYWORDS, decompress_into__doc__},
+    {"crc32", zlibbuf_crc32, METH_VARARGS, crc32__doc__},
+    {"adler32", zlibbuf_adler32, METH_VARARGS, adler32__doc__},
+    {NULL, NULL, 0, NULL}
+};
+
+
+PyDoc_STRVAR(zlibbuf__doc__,
+"Zero-copy zlib compression for any buffer-protocol object.\n"
+"\n"
+"The functions mirror the zlib module's compress(), decompress(), crc32()\n"
+"and adler32(), and release the GIL while zlib runs.  compress_into() and\n"
+"decompress_into() write into a caller-provided buffer.");
+
+static struct PyModuleDef zlibbuf_module = {
+    PyModuleDef_HEAD_INIT,
+    "zlibbuf",
+    zlibbuf__doc__,
+    -1,
+    zlibbuf_methods,
+    NULL,
+    NULL,
+    NULL,
+    NULL
+};
+
+
+PyMODINIT_FUNC PyInit_zlibbuf(void) {
+    PyObject *module = PyModule_Create(&zlibbuf_module);
+    if (module == NULL) {
+        return NULL;
+    }
+    ZlibbufError = PyErr_NewException("zlibbuf.error", NULL, NULL);
+    if (ZlibbufError == NULL) {
+        Py_DECREF(module);
+        return NULL;
+    }
+    Py_INCREF(ZlibbufError);
+    if (PyModule_AddObject(module, "error", ZlibbufError) < 0 ||
+        PyModule_AddStringConstant(module, "ZLIB_VERSION", ZLIB_VERSION) < 0 ||
+        PyModule_AddStringConstant(module, "ZLIB_RUNTIME_VERSION", zlibVersion()) < 0 ||
+        PyModule_AddIntConstant(module, "MAX_WBITS", MAX_WBITS) < 0 ||
+        PyModule_AddIntConstant(module, "DEF_MEM_LEVEL", DEF_MEM_LEVEL) < 0 ||
+        PyModule_AddIntConstant(module, "Z_BEST_SPEED", Z_BEST_SPEED) < 0 ||
+        PyModule_AddIntConstant(module, "Z_BEST_COMPRESSION", Z_BEST_COMPRESSION) < 0 ||
+        PyModule_AddIntConstant(module, "Z_DEFAULT_COMPRESSION", Z_DEFAULT_COMPRESSION) < 0) {
+        Py_DECREF(ZlibbufError);
+        Py_DECREF(module);
+        return NULL;
+    }
+    return module;
+}
@@ -1,9 +1,16 @@
 import os
+import sys
 
 import conans
 
+# inflate_bench.c and the throughput check are shared with the other test
+# project.
+TEST_COMMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'test_common')
+sys.path.insert(0, TEST_COMMON_DIR)
+from inflate_throughput import InflateThroughputCheck
 
-class AutotoolsZlibUser(conans.ConanFile):
+
+class AutotoolsZlibUser(InflateThroughputCheck, conans.ConanFile):
     """
     This tests the zlib package by building an application that links to it.
     This uses Autoconf and Automake to build.
@@ -77,6 +84,7 @@ class AutotoolsZlibUser(conans.ConanFile):
         pkgconfig_exec = 'pkg-config --define-variable conan_storage_path=%s' % (conan_storage_path)
         
         vars['PKG_CONFIG'] = pkgconfig_exec
+        vars['TEST_COMMON_DIR'] = os.path.realpath(TEST_COMMON_DIR)
         
         cpu_count = conans.tools.cpu_count()
         self.output.info('Detected %s cores.' % (cpu_count))
@@ -99,3 +107,6 @@ class AutotoolsZlibUser(conans.ConanFile):
         executables = [os.path.join(os.curdir, 'src', 'main_c'), os.path.join(os.curdir, 'src', 'main_cpp')]
         for executable in executables:
             self.run('%s' % (executable))
+        
+        if not self.scope.skipBenchmark:
+            self._check_inflate_throughput(os.path.join(os.curdir, 'src', 'inflate_bench'))
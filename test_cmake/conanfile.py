@@ -1,15 +1,22 @@
 import os
+import sys
 
 import conans
 
+# inflate_bench.c and the throughput check are shared with the other test
+# project.
+TEST_COMMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'test_common')
+sys.path.insert(0, TEST_COMMON_DIR)
+from inflate_throughput import InflateThroughputCheck
 
-class CMakeZlibUser(conans.ConanFile):
+
+class CMakeZlibUser(InflateThroughputCheck, conans.ConanFile):
     """
     This tests the zlib package by building an application that links to it.
     This uses CMake to build.
     """
     settings = 'os', 'compiler', 'build_type', 'arch'
-    exports_sources = 'CMakeLists.txt', 'main.cpp'
+    exports_sources = 'CMakeLists.txt', 'main.c', 'main.cpp'
     requires = 'zlib/1.2.11@kent_at_multiscale/stable'
     generators = 'cmake', 'env', 'txt'
     
@@ -40,6 +47,7 @@ class CMakeZlibUser(conans.ConanFile):
             vars['CMAKE_VERBOSE_MAKEFILE'] = 'ON'
         else:
             vars['CMAKE_VERBOSE_MAKEFILE'] = 'OFF'
+        vars['TEST_COMMON_DIR'] = os.path.realpath(TEST_COMMON_DIR)
         
         cpu_count = conans.tools.cpu_count()
         self.output.info('Detected %s CPUs' % (cpu_count))
@@ -59,3 +67,8 @@ class CMakeZlibUser(conans.ConanFile):
         
         self.output.info('Running tests')
         self.run('ctest --parallel %s' % (cpu_count))
+        
+        # The throughput check runs on its own rather than under CTest so
+        # that it does not compete with the other tests for cores.
+        if not self.scope.skipBenchmark:
+            self._check_inflate_throughput(os.path.join(os.curdir, 'bin', 'inflate_bench'))
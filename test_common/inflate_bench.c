@@ -0,0 +1,217 @@
+#define _POSIX_C_SOURCE 200809L
+
+#include <zlib.h>
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+
+/*
+ * Inflates a fixed corpus over and over and writes the throughput of each
+ * sample, and their median, to a JSON file.  The corpus is 384 KiB of word
+ * text followed by 128 KiB of struct-like records, generated from fixed
+ * seeds the same way bench_zlib generates its corpora, and deflated once at
+ * level 6 before timing starts.
+ *
+ * usage: inflate_bench OUTPUT [SAMPLES] [MIN_SECONDS_PER_SAMPLE]
+ */
+
+#define DEFAULT_SAMPLES 9
+#define DEFAULT_MIN_SECONDS 0.1
+#define TEXT_SIZE (384 * 1024)
+#define BINARY_SIZE (128 * 1024)
+#define CORPUS_SIZE (TEXT_SIZE + BINARY_SIZE)
+
+static const char *words[] = {
+    "the", "of", "and", "to", "in", "is", "that", "for", "it", "as",
+    "with", "was", "on", "be", "by", "this", "are", "from", "or", "at",
+    "compression", "library", "stream", "window", "buffer", "deflate", "inflate",
+    "checksum", "package", "recipe", "dictionary", "literal", "distance", "length",
+    "huffman", "block", "header", "trailer", "throughput", "latency", "memory",
+};
+
+
+static double now(void) {
+    struct timespec ts;
+#if defined(CLOCK_MONOTONIC)
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+#else
+    timespec_get(&ts, TIME_UTC);
+#endif
+    return (double) ts.tv_sec + (double) ts.tv_nsec / 1e9;
+}
+
+static int compare_doubles(const void *a, const void *b) {
+    double x = *(const double *) a;
+    double y = *(const double *) b;
+    return (x > y) - (x < y);
+}
+
+static unsigned long next_random(unsigned long long *state) {
+    /* xorshift64*, deterministic so every run sees the same corpus. */
+    unsigned long long x = *state;
+    x ^= x >> 12;
+    x ^= x << 25;
+    x ^= x >> 27;
+    *state = x;
+    return (unsigned long) ((x * 0x2545F4914F6CDD1DULL) >> 32);
+}
+
+static void fill_text(unsigned char *data, size_t size, unsigned long long seed) {
+    unsigned long long state = seed;
+    size_t pos = 0;
+    size_t words_in_line = 0;
+    while (pos < size) {
+        const char *word = words[next_random(&state) % (sizeof(words) / sizeof(words[0]))];
+        size_t len = strlen(word);
+        size_t i;
+        for (i = 0; i < len && pos < size; ++i) {
+            data[pos++] = (unsigned char) word[i];
+        }
+        if (pos < size) {
+            ++words_in_line;
+            if (words_in_line >= 12) {
+                data[pos++] = '\n';
+                words_in_line = 0;
+            } else if (next_random(&state) % 16 == 0) {
+                data[pos++] = ',';
+            } else {
+                data[pos++] = ' ';
+            }
+        }
+    }
+}
+
+static void fill_binary(unsigned char *data, size_t size, unsigned long long seed) {
+    unsigned long long state = seed;
+    unsigned long counter = 0;
+    size_t pos = 0;
+    while (pos < size) {
+        unsigned char record[16];
+        unsigned long noise = next_random(&state);
+        size_t i;
+        memset(record, 0, sizeof(record));
+        record[0] = (unsigned char) (counter & 0xff);
+        record[1] = (unsigned char) ((counter >> 8) & 0xff);
+        record[2] = (unsigned char) ((counter >> 16) & 0xff);
+        record[4] = (unsigned char) (noise % 8);
+        record[8] = (unsigned char) (noise & 0xff);
+        record[9] = (unsigned char) ((noise >> 8) & 0x0f);
+        record[10] = 0x40;
+        record[11] = 0x3f;
+        record[12] = (unsigned char) (noise % 3 ? 0x00 : 0xff);
+        for (i = 0; i < sizeof(record) && pos < size; ++i) {
+            data[pos++] = record[i];
+        }
+        ++counter;
+    }
+}
+
+
+int main(int argc, char **argv) {
+    const char *output_path;
+    int samples = DEFAULT_SAMPLES;
+    double min_seconds = DEFAULT_MIN_SECONDS;
+    unsigned char *corpus;
+    unsigned char *compressed;
+    unsigned char *uncompressed;
+    uLongf compressed_size;
+    double *throughput;
+    double median;
+    z_stream stream;
+    FILE *output;
+    int i;
+
+    if (argc < 2) {
+        fprintf(stderr, "usage: %s OUTPUT [SAMPLES] [MIN_SECONDS_PER_SAMPLE]\n", argv[0]);
+        return 2;
+    }
+    output_path = argv[1];
+    if (argc > 2) {
+        samples = atoi(argv[2]);
+    }
+    if (argc > 3) {
+        min_seconds = atof(argv[3]);
+    }
+    if (samples < 1 || min_seconds <= 0) {
+        fprintf(stderr, "SAMPLES and MIN_SECONDS_PER_SAMPLE must be positive\n");
+        return 2;
+    }
+
+    corpus = malloc(CORPUS_SIZE);
+    uncompressed = malloc(CORPUS_SIZE);
+    compressed_size = compressBound(CORPUS_SIZE);
+    compressed = malloc(compressed_size);
+    throughput = calloc((size_t) samples, sizeof(*throughput));
+    if (corpus == NULL || uncompressed == NULL || compressed == NULL || throughput == NULL) {
+        fprintf(stderr, "out of memory\n");
+        return 1;
+    }
+    fill_text(corpus, TEXT_SIZE, 0x9E3779B97F4A7C15ULL);
+    fill_binary(corpus + TEXT_SIZE, BINARY_SIZE, 0xD1B54A32D192ED03ULL);
+    if (compress2(compressed, &compressed_size, corpus, CORPUS_SIZE, 6) != Z_OK) {
+        fprintf(stderr, "compress2 failed while building the corpus\n");
+        return 1;
+    }
+
+    memset(&stream, 0, sizeof(stream));
+    if (inflateInit(&stream) != Z_OK) {
+        fprintf(stderr, "inflateInit failed\n");
+        return 1;
+    }
+    for (i = 0; i < samples; ++i) {
+        unsigned long iterations = 0;
+        double start = now();
+        double seconds;
+        do {
+            inflateReset(&stream);
+            stream.next_in = compressed;
+            stream.avail_in = (uInt) compressed_size;
+            stream.next_out = uncompressed;
+            stream.avail_out = CORPUS_SIZE;
+            if (inflate(&stream, Z_FINISH) != Z_STREAM_END) {
+                fprintf(stderr, "inflate failed: %s\n", stream.msg ? stream.msg : "unknown error");
+                return 1;
+            }
+            ++iterations;
+            seconds = now() - start;
+        } while (seconds < min_seconds);
+        throughput[i] = (double) CORPUS_SIZE * (double) iterations / seconds / 1e6;
+    }
+    inflateEnd(&stream);
+    if (stream.total_out != CORPUS_SIZE || memcmp(corpus, uncompressed, CORPUS_SIZE) != 0) {
+        fprintf(stderr, "inflate did not restore the corpus\n");
+        return 1;
+    }
+
+    output = fopen(output_path, "w");
+    if (output == NULL) {
+        fprintf(stderr, "unable to open %s for writing\n", output_path);
+        return 1;
+    }
+    fprintf(output, "{\n");
+    fprintf(output, "  \"zlib_version\": \"%s\",\n", zlibVersion());
+    fprintf(output, "  \"compressed_bytes\": %lu,\n", (unsigned long) compressed_size);
+    fprintf(output, "  \"uncompressed_bytes\": %lu,\n", (unsigned long) CORPUS_SIZE);
+    fprintf(output, "  \"samples_mb_per_s\": [");
+    for (i = 0; i < samples; ++i) {
+        fprintf(output, "%s%.2f", i ? ", " : "", throughput[i]);
+    }
+    fprintf(output, "],\n");
+    qsort(throughput, (size_t) samples, sizeof(*throughput), compare_doubles);
+    median = samples % 2 ? throughput[samples / 2] : (throughput[samples / 2 - 1] + throughput[samples / 2]) / 2;
+    fprintf(output, "  \"median_mb_per_s\": %.2f\n", median);
+    fprintf(output, "}\n");
+    fclose(output);
+
+    printf("inflated %lu bytes from %lu, median %.2f MB/s over %d samples\n",
+           (unsigned long) CORPUS_SIZE, (unsigned long) compressed_size, median, samples);
+
+    free(throughput);
+    free(compressed);
+    free(uncompressed);
+    free(corpus);
+    return 0;
+}
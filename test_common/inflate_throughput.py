@@ -0,0 +1,101 @@
+"""
+The inflate throughput check shared by test_cmake and test_autotools.  Both
+build inflate_bench.c from this folder and mix InflateThroughputCheck into
+their conanfiles.
+"""
+import json
+import os
+import platform
+
+import conans
+
+
+DEFAULT_THRESHOLD_PERCENT = 20
+
+
+class InflateThroughputCheck(object):
+    """
+    Mixed into a test conanfile ahead of conans.ConanFile.
+    """
+    def _inflate_baselines_path(self):
+        """
+        Returns the file holding the inflate baselines.  The inflateBaseline
+        scope can point it somewhere other than the Conan home, such as a
+        file a CI machine keeps between runs.
+        """
+        if self.scope.inflateBaseline:
+            return os.path.abspath(str(self.scope.inflateBaseline))
+        return os.path.join(os.environ.get('CONAN_USER_HOME', os.path.expanduser('~')), '.conan', 'zlib_inflate_baselines.json')
+    
+    def _inflate_baseline_key(self, manifest):
+        """
+        Baselines are kept per machine and per configuration family: the
+        settings and linkage that decide whether two measurements are
+        comparable at all.  The backend, march, optimize and the tuning
+        options are deliberately left out, so a package built with
+        different ones is held to the same baseline.  That is how a slow
+        backend or a bad compiler flag shows up as a regression.
+        """
+        settings = manifest['settings']
+        return 'host=%s os=%s arch=%s build_type=%s shared=%s' % (platform.node() or 'unknown', settings['os'], settings['arch'], settings['build_type'], manifest['options']['shared'])
+    
+    def _check_inflate_throughput(self, executable):
+        """
+        Inflates a generated corpus and compares the median throughput with
+        the baseline for this machine and configuration family, failing if
+        it dropped by more than 20%, or by the percentage in the
+        inflateThreshold scope.
+        
+        The updateInflateBaseline scope records this run as the baseline.
+        When there is no baseline yet, this run is recorded as one with a
+        warning, so later runs on the machine are checked against it, or the
+        test fails if the requireInflateBaseline scope is set.
+        """
+        result_path = os.path.join(os.path.realpath(os.curdir), 'inflate_result.json')
+        self.output.info('Measuring inflate throughput')
+        self.run('%s "%s"' % (executable, result_path))
+        with open(result_path, 'r') as input:
+            result = json.load(input)
+        
+        rootpath = self.deps_cpp_info['zlib'].rootpath
+        with open(os.path.join(rootpath, 'zlib_manifest.json'), 'r') as input:
+            manifest = json.load(input)
+        configuration = ' '.join('%s=%s' % (name, manifest['options'][name]) for name in ('backend', 'march', 'optimize'))
+        key = self._inflate_baseline_key(manifest)
+        
+        baselines_path = self._inflate_baselines_path()
+        baselines = {}
+        if os.path.exists(baselines_path):
+            with open(baselines_path, 'r') as input:
+                baselines = json.load(input)
+        baseline = baselines.get(key)
+        
+        if baseline is None and self.scope.requireInflateBaseline and not self.scope.updateInflateBaseline:
+            raise conans.errors.ConanException('No inflate baseline for %s in %s; record one with the updateInflateBaseline scope' % (key, baselines_path))
+        
+        if baseline is None or self.scope.updateInflateBaseline:
+            if baseline is None:
+                self.output.warn('*' * 72)
+                self.output.warn('NO INFLATE BASELINE for %s in %s.' % (key, baselines_path))
+                self.output.warn('This run (%.2f MB/s with %s) is NOT checked for a regression.' % (result['median_mb_per_s'], configuration))
+                self.output.warn('It is recorded as the baseline that later runs here are checked against.')
+                self.output.warn('*' * 72)
+            baselines[key] = {
+                'configuration': configuration,
+                'median_mb_per_s': result['median_mb_per_s'],
+                'package_id': os.path.basename(rootpath),
+                'zlib_version': result['zlib_version'],
+            }
+            if not os.path.isdir(os.path.dirname(baselines_path)):
+                os.makedirs(os.path.dirname(baselines_path))
+            with open(baselines_path, 'w') as output:
+                json.dump(baselines, output, indent=2, sort_keys=True)
+                output.write('\n')
+            self.output.info('Recorded %.2f MB/s as the inflate baseline for %s in %s' % (result['median_mb_per_s'], key, baselines_path))
+            return
+        
+        threshold = float(self.scope.inflateThreshold if self.scope.inflateThreshold is not None else DEFAULT_THRESHOLD_PERCENT)
+        floor = baseline['median_mb_per_s'] * (1 - threshold / 100.0)
+        self.output.info('Median inflate throughput %.2f MB/s with %s, baseline %.2f MB/s with %s, minimum %.2f MB/s (%s%% regression allowed)' % (result['median_mb_per_s'], configuration, baseline['median_mb_per_s'], baseline['configuration'], floor, threshold))
+        if result['median_mb_per_s'] < floor:
+            raise conans.errors.ConanException('Inflate throughput regressed to %.2f MB/s with %s, more than %s%% below the baseline of %.2f MB/s with %s' % (result['median_mb_per_s'], configuration, threshold, baseline['median_mb_per_s'], baseline['configuration']))
@@ -0,0 +1,473 @@
+#define _POSIX_C_SOURCE 200809L
+
+#include <zlib.h>
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+
+#define CHUNK_SIZE (64 * 1024)
+/* zlib's default memory level, unless the package was built with a lower maximum. */
+#define MEM_LEVEL (MAX_MEM_LEVEL < 8 ? MAX_MEM_LEVEL : 8)
+
+typedef struct {
+    const char *name;
+    unsigned char *data;
+    size_t size;
+} corpus_t;
+
+typedef struct {
+    const char *name;
+    int value;
+} strategy_t;
+
+typedef struct {
+    const char *corpus;
+    const char *api;
+    const char *operation;
+    int level;
+    const char *strategy;
+    size_t input_bytes;
+    size_t output_bytes;
+    double seconds;
+    unsigned long iterations;
+} result_t;
+
+static const strategy_t strategies[] = {
+    {"default", Z_DEFAULT_STRATEGY},
+    {"filtered", Z_FILTERED},
+    {"huffman_only", Z_HUFFMAN_ONLY},
+    {"rle", Z_RLE},
+    {"fixed", Z_FIXED},
+};
+
+static const char *words[] = {
+    "the", "of", "and", "to", "in", "is", "that", "for", "it", "as",
+    "with", "was", "on", "be", "by", "this", "are", "from", "or", "at",
+    "compression", "library", "stream", "window", "buffer", "deflate", "inflate",
+    "checksum", "package", "recipe", "dictionary", "literal", "distance", "length",
+    "huffman", "block", "header", "trailer", "throughput", "latency", "memory",
+};
+
+static result_t *results = NULL;
+static size_t result_count = 0;
+static size_t result_capacity = 0;
+
+static double min_seconds = 0.05;
+
+
+static double now(void) {
+    struct timespec ts;
+#if defined(CLOCK_MONOTONIC)
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+#else
+    timespec_get(&ts, TIME_UTC);
+#endif
+    return (double) ts.tv_sec + (double) ts.tv_nsec / 1e9;
+}
+
+static unsigned long next_random(unsigned long long *state) {
+    /* xorshift64*, deterministic so every run sees the same corpus. */
+    unsigned long long x = *state;
+    x ^= x >> 12;
+    x ^= x << 25;
+    x ^= x >> 27;
+    *state = x;
+    return (unsigned long) ((x * 0x2545F4914F6CDD1DULL) >> 32);
+}
+
+static void *xmalloc(size_t size) {
+    void *ptr = malloc(size ? size : 1);
+    if (ptr == NULL) {
+        fprintf(stderr, "out of memory allocating %lu bytes\n", (unsigned long) size);
+        exit(EXIT_FAILURE);
+    }
+    return ptr;
+}
+
+static void fill_text(unsigned char *data, size_t size, unsigned long long seed) {
+    unsigned long long state = seed;
+    size_t pos = 0;
+    size_t words_in_line = 0;
+    while (pos < size) {
+        const char *word = words[next_random(&state) % (sizeof(words) / sizeof(words[0]))];
+        size_t len = strlen(word);
+        size_t i;
+        for (i = 0; i < len && pos < size; ++i) {
+            data[pos++] = (unsigned char) word[i];
+        }
+        if (pos < size) {
+            ++words_in_line;
+            if (words_in_line >= 12) {
+                data[pos++] = '\n';
+                words_in_line = 0;
+            } else if (next_random(&state) % 16 == 0) {
+                data[pos++] = ',';
+            } else {
+                data[pos++] = ' ';
+            }
+        }
+    }
+}
+
+static void fill_binary(unsigned char *data, size_t size, unsigned long long seed) {
+    /* Fixed-width records with counters, small integers and noisy low bytes,
+       which is roughly what object files and serialized structs look like. */
+    unsigned long long state = seed;
+    unsigned long counter = 0;
+    size_t pos = 0;
+    while (pos < size) {
+        unsigned char record[16];
+        unsigned long noise = next_random(&state);
+        size_t i;
+        record[0] = (unsigned char) (counter & 0xff);
+        record[1] = (unsigned char) ((counter >> 8) & 0xff);
+        record[2] = (unsigned char) ((counter >> 16) & 0xff);
+        record[3] = 0;
+        record[4] = (unsigned char) (noise % 8);
+        record[5] = 0;
+        record[6] = 0;
+        record[7] = 0;
+        record[8] = (unsigned char) (noise & 0xff);
+        record[9] = (unsigned char) ((noise >> 8) & 0x0f);
+        record[10] = 0x40;
+        record[11] = 0x3f;
+        record[12] = (unsigned char) (noise % 3 ? 0x00 : 0xff);
+        record[13] = 0;
+        record[14] = 0;
+        record[15] = 0;
+        for (i = 0; i < sizeof(record) && pos < size; ++i) {
+            data[pos++] = record[i];
+        }
+        ++counter;
+    }
+}
+
+static void fill_compressed(unsigned char *data, size_t size, unsigned long long seed) {
+    /* Concatenate maximally compressed blocks of fresh text until full. */
+    size_t text_size = 256 * 1024;
+    unsigned char *text = xmalloc(text_size);
+    uLongf bound = compressBound((uLong) text_size);
+    unsigned char *packed = xmalloc(bound);
+    size_t pos = 0;
+    while (pos < size) {
+        uLongf packed_size = bound;
+        size_t take;
+        fill_text(text, text_size, seed++);
+        if (compress2(packed, &packed_size, text, (uLong) text_size, 9) != Z_OK) {
+            fprintf(stderr, "compress2 failed while building corpus\n");
+            exit(EXIT_FAILURE);
+        }
+        take = size - pos < packed_size ? size - pos : packed_size;
+        memcpy(data + pos, packed, take);
+        pos += take;
+    }
+    free(packed);
+    free(text);
+}
+
+static void record(const result_t *result) {
+    if (result_count == result_capacity) {
+        result_t *grown;
+        result_capacity = result_capacity ? result_capacity * 2 : 64;
+        grown = realloc(results, result_capacity * sizeof(result_t));
+        if (grown == NULL) {
+            fprintf(stderr, "out of memory recording results\n");
+            exit(EXIT_FAILURE);
+        }
+        results = grown;
+    }
+    results[result_count++] = *result;
+}
+
+static double mb_per_s(const result_t *result) {
+    if (result->seconds <= 0.0) {
+        return 0.0;
+    }
+    return (double) result->input_bytes * result->iterations / result->seconds / (1024.0 * 1024.0);
+}
+
+static double ratio(const result_t *result) {
+    if (result->output_bytes == 0) {
+        return 0.0;
+    }
+    return (double) result->input_bytes / (double) result->output_bytes;
+}
+
+static size_t stream_deflate(const corpus_t *corpus, int level, int strategy, unsigned char *out, size_t out_size) {
+    z_stream stream;
+    size_t in_pos = 0;
+    int flush;
+    memset(&stream, 0, sizeof(stream));
+    if (deflateInit2(&stream, level, Z_DEFLATED, MAX_WBITS, MEM_LEVEL, strategy) != Z_OK) {
+        fprintf(stderr, "deflateInit2 failed\n");
+        exit(EXIT_FAILURE);
+    }
+    stream.next_out = out;
+    stream.avail_out = (uInt) out_size;
+    do {
+        size_t take = corpus->size - in_pos < CHUNK_SIZE ? corpus->size - in_pos : CHUNK_SIZE;
+        stream.next_in = corpus->data + in_pos;
+        stream.avail_in = (uInt) take;
+        in_pos += take;
+        flush = in_pos == corpus->size ? Z_FINISH : Z_NO_FLUSH;
+        if (deflate(&stream, flush) == Z_STREAM_ERROR) {
+            fprintf(stderr, "deflate failed\n");
+            exit(EXIT_FAILURE);
+        }
+    } while (flush != Z_FINISH);
+    deflateEnd(&stream);
+    return (size_t) stream.total_out;
+}
+
+static size_t stream_inflate(const unsigned char *in, size_t in_size, unsigned char *out, size_t out_size) {
+    z_stream stream;
+    size_t in_pos = 0;
+    int ret;
+    memset(&stream, 0, sizeof(stream));
+    if (inflateInit(&stream) != Z_OK) {
+        fprintf(stderr, "inflateInit failed\n");
+        exit(EXIT_FAILURE);
+    }
+    stream.next_out = out;
+    stream.avail_out = (uInt) out_size;
+    do {
+        size_t take = in_size - in_pos < CHUNK_SIZE ? in_size - in_pos : CHUNK_SIZE;
+        stream.next_in = (unsigned char *) in + in_pos;
+        stream.avail_in = (uInt) take;
+        in_pos += take;
+        ret = inflate(&stream, Z_NO_FLUSH);
+        if (ret != Z_OK && ret != Z_STREAM_END) {
+            fprintf(stderr, "inflate failed: %d\n", ret);
+            exit(EXIT_FAILURE);
+        }
+    } while (ret != Z_STREAM_END);
+    inflateEnd(&stream);
+    return (size_t) stream.total_out;
+}
+
+static void verify(const corpus_t *corpus, const unsigned char *roundtrip, size_t size, const char *what) {
+    if (size != corpus->size || memcmp(corpus->data, roundtrip, size) != 0) {
+        fprintf(stderr, "%s round trip of %s corpus does not match the input\n", what, corpus->name);
+        exit(EXIT_FAILURE);
+    }
+}
+
+static void bench_one_shot(const corpus_t *corpus, int level, unsigned char *packed, size_t packed_capacity, unsigned char *unpacked) {
+    result_t compress_result = {corpus->name, "compress2", "compress", level, "default", corpus->size, 0, 0.0, 0};
+    result_t uncompress_result = {corpus->name, "compress2", "uncompress", level, "default", corpus->size, 0, 0.0, 0};
+    uLongf packed_size = 0;
+    uLongf unpacked_size = 0;
+    double start = now();
+    do {
+        packed_size = (uLongf) packed_capacity;
+        if (compress2(packed, &packed_size, corpus->data, (uLong) corpus->size, level) != Z_OK) {
+            fprintf(stderr, "compress2 failed\n");
+            exit(EXIT_FAILURE);
+        }
+        ++compress_result.iterations;
+        compress_result.seconds = now() - start;
+    } while (compress_result.seconds < min_seconds);
+    compress_result.output_bytes = (size_t) packed_size;
+
+    start = now();
+    do {
+        unpacked_size = (uLongf) corpus->size;
+        if (uncompress(unpacked, &unpacked_size, packed, packed_size) != Z_OK) {
+            fprintf(stderr, "uncompress failed\n");
+            exit(EXIT_FAILURE);
+        }
+        ++uncompress_result.iterations;
+        uncompress_result.seconds = now() - start;
+    } while (uncompress_result.seconds < min_seconds);
+    uncompress_result.output_bytes = (size_t) packed_size;
+    verify(corpus, unpacked, (size_t) unpacked_size, "compress2/uncompress");
+
+    record(&compress_result);
+    record(&uncompress_result);
+}
+
+static void bench_streaming(const corpus_t *corpus, int level, const strategy_t *strategy, unsigned char *packed, size_t packed_capacity, unsigned char *unpacked) {
+    result_t deflate_result = {corpus->name, "stream", "deflate", level, strategy->name, corpus->size, 0, 0.0, 0};
+    result_t inflate_result = {corpus->name, "stream", "inflate", level, strategy->name, corpus->size, 0, 0.0, 0};
+    size_t packed_size = 0;
+    size_t unpacked_size = 0;
+    double start = now();
+    do {
+        packed_size = stream_deflate(corpus, level, strategy->value, packed, packed_capacity);
+        ++deflate_result.iterations;
+        deflate_result.seconds = now() - start;
+    } while (deflate_result.seconds < min_seconds);
+    deflate_result.output_bytes = packed_size;
+
+    start = now();
+    do {
+        unpacked_size = stream_inflate(packed, packed_size, unpacked, corpus->size);
+        ++inflate_result.iterations;
+        inflate_result.seconds = now() - start;
+    } while (inflate_result.seconds < min_seconds);
+    inflate_result.output_bytes = packed_size;
+    verify(corpus, unpacked, unpacked_size, "deflate/inflate");
+
+    record(&deflate_result);
+    record(&inflate_result);
+}
+
+static void bench_checksums(const corpus_t *corpus) {
+    result_t crc_result = {corpus->name, "checksum", "crc32", 0, "none", corpus->size, 0, 0.0, 0};
+    result_t adler_result = {corpus->name, "checksum", "adler32", 0, "none", corpus->size, 0, 0.0, 0};
+    volatile uLong sink = 0;
+    double start = now();
+    do {
+        sink ^= crc32(crc32(0L, Z_NULL, 0), corpus->data, (uInt) corpus->size);
+        ++crc_result.iterations;
+        crc_result.seconds = now() - start;
+    } while (crc_result.seconds < min_seconds);
+
+    start = now();
+    do {
+        sink ^= adler32(adler32(0L, Z_NULL, 0), corpus->data, (uInt) corpus->size);
+        ++adler_result.iterations;
+        adler_result.seconds = now() - start;
+    } while (adler_result.seconds < min_seconds);
+    (void) sink;
+
+    record(&crc_result);
+    record(&adler_result);
+}
+
+static int write_json(const char *path, size_t corpus_size) {
+    FILE *output = fopen(path, "w");
+    size_t i;
+    if (output == NULL) {
+        fprintf(stderr, "unable to open %s for writing\n", path);
+        return 0;
+    }
+    fprintf(output, "{\n");
+    fprintf(output, "  \"zlib_version\": \"%s\",\n", zlibVersion());
+    fprintf(output, "  \"compile_flags\": %lu,\n", (unsigned long) zlibCompileFlags());
+    fprintf(output, "  \"corpus_bytes\": %lu,\n", (unsigned long) corpus_size);
+    fprintf(output, "  \"min_seconds\": %g,\n", min_seconds);
+    fprintf(output, "  \"results\": [\n");
+    for (i = 0; i < result_count; ++i) {
+        const result_t *r = &results[i];
+        fprintf(output, "    {\"corpus\": \"%s\", \"api\": \"%s\", \"operation\": \"%s\", \"level\": %d, \"strategy\": \"%s\", "
+                "\"input_bytes\": %lu, \"output_bytes\": %lu, \"ratio\": %.4f, \"iterations\": %lu, \"seconds\": %.6f, \"mb_per_s\": %.2f}%s\n",
+                r->corpus, r->api, r->operation, r->level, r->strategy,
+                (unsigned long) r->input_bytes, (unsigned long) r->output_bytes, ratio(r), r->iterations, r->seconds, mb_per_s(r),
+                i + 1 < result_count ? "," : "");
+    }
+    fprintf(output, "  ]\n");
+    fprintf(output, "}\n");
+    fclose(output);
+    return 1;
+}
+
+static int write_csv(const char *path) {
+    FILE *output = fopen(path, "w");
+    size_t i;
+    if (output == NULL) {
+        fprintf(stderr, "unable to open %s for writing\n", path);
+        return 0;
+    }
+    fprintf(output, "corpus,api,operation,level,strategy,input_bytes,output_bytes,ratio,iterations,seconds,mb_per_s\n");
+    for (i = 0; i < result_count; ++i) {
+        const result_t *r = &results[i];
+        fprintf(output, "%s,%s,%s,%d,%s,%lu,%lu,%.4f,%lu,%.6f,%.2f\n",
+                r->corpus, r->api, r->operation, r->level, r->strategy,
+                (unsigned long) r->input_bytes, (unsigned long) r->output_bytes, ratio(r), r->iterations, r->seconds, mb_per_s(r));
+    }
+    fclose(output);
+    return 1;
+}
+
+static void usage(const char *program) {
+    fprintf(stderr, "usage: %s [--output PREFIX] [--size KIB] [--min-time SECONDS]\n", program);
+}
+
+
+int main(int argc, char **argv) {
+    const char *prefix = "zlib_benchmark";
+    size_t corpus_size = 1024 * 1024;
+    corpus_t corpora[3];
+    size_t corpus_count = sizeof(corpora) / sizeof(corpora[0]);
+    size_t packed_capacity;
+    unsigned char *packed;
+    unsigned char *unpacked;
+    char *json_path;
+    char *csv_path;
+    size_t c;
+    int level;
+    size_t s;
+    int i;
+
+    for (i = 1; i < argc; ++i) {
+        if (strcmp(argv[i], "--output") == 0 && i + 1 < argc) {
+            prefix = argv[++i];
+        } else if (strcmp(argv[i], "--size") == 0 && i + 1 < argc) {
+            corpus_size = (size_t) strtoul(argv[++i], NULL, 10) * 1024;
+        } else if (strcmp(argv[i], "--min-time") == 0 && i + 1 < argc) {
+            min_seconds = strtod(argv[++i], NULL);
+        } else {
+            usage(argv[0]);
+            return EXIT_FAILURE;
+        }
+    }
+    if (corpus_size == 0) {
+        usage(argv[0]);
+        return EXIT_FAILURE;
+    }
+
+    corpora[0].name = "text";
+    corpora[1].name = "binary";
+    corpora[2].name = "compressed";
+    for (c = 0; c < corpus_count; ++c) {
+        corpora[c].size = corpus_size;
+        corpora[c].data = xmalloc(corpus_size);
+    }
+    fill_text(corpora[0].data, corpus_size, 0x9E3779B97F4A7C15ULL);
+    fill_binary(corpora[1].data, corpus_size, 0xD1B54A32D192ED03ULL);
+    fill_compressed(corpora[2].data, corpus_size, 0x8CB92BA72F3D8DD7ULL);
+
+    packed_capacity = (size_t) compressBound((uLong) corpus_size) + CHUNK_SIZE;
+    packed = xmalloc(packed_capacity);
+    unpacked = xmalloc(corpus_size);
+
+    printf("zlib %s benchmark, %lu byte corpora\n", zlibVersion(), (unsigned long) corpus_size);
+    for (c = 0; c < corpus_count; ++c) {
+        for (level = 1; level <= 9; ++level) {
+            bench_one_shot(&corpora[c], level, packed, packed_capacity, unpacked);
+            for (s = 0; s < sizeof(strategies) / sizeof(strategies[0]); ++s) {
+                bench_streaming(&corpora[c], level, &strategies[s], packed, packed_capacity, unpacked);
+            }
+        }
+        bench_checksums(&corpora[c]);
+    }
+
+    for (c = 0; c < result_count; ++c) {
+        const result_t *r = &results[c];
+        printf("%-10s %-9s %-10s level %d %-12s %9.2f MB/s  ratio %6.3f\n",
+               r->corpus, r->api, r->operation, r->level, r->strategy, mb_per_s(r), ratio(r));
+    }
+
+    json_path = xmalloc(strlen(prefix) + sizeof(".json"));
+    csv_path = xmalloc(strlen(prefix) + sizeof(".csv"));
+    sprintf(json_path, "%s.json", prefix);
+    sprintf(csv_path, "%s.csv", prefix);
+    if (!write_json(json_path, corpus_size) || !write_csv(csv_path)) {
+        return EXIT_FAILURE;
+    }
+    printf("Wrote %s and %s\n", json_path, csv_path);
+
+    free(csv_path);
+    free(json_path);
+    free(unpacked);
+    free(packed);
+    for (c = 0; c < corpus_count; ++c) {
+        free(corpora[c].data);
+    }
+    free(results);
+    return EXIT_SUCCESS;
+}
@@ -0,0 +1,266 @@
+"""
+Checks the zlibbuf extension from the zlib package and benchmarks it against
+the standard library's zlib module.
+
+The corpora are byte for byte the ones bench_zlib generates for the same
+size.  Every corpus is first round-tripped between the two modules, through bytes,
+memoryview slices, mmap, array.array and caller-provided output buffers.
+Then each operation is timed for both modules on a single thread and on a
+thread pool, and the results are written to PREFIX.json and PREFIX.csv in
+the same shape as bench_zlib's.
+"""
+import argparse
+import array
+import csv
+import json
+import mmap
+import multiprocessing.pool
+import sys
+import time
+import zlib
+
+import zlibbuf
+
+
+# The words, seeds and generators below are bench_zlib.c's, so both
+# benchmarks measure the same bytes.
+WORDS = (b'the', b'of', b'and', b'to', b'in', b'is', b'that', b'for', b'it', b'as',
+         b'with', b'was', b'on', b'be', b'by', b'this', b'are', b'from', b'or', b'at',
+         b'compression', b'library', b'stream', b'window', b'buffer', b'deflate', b'inflate',
+         b'checksum', b'package', b'recipe', b'dictionary', b'literal', b'distance', b'length',
+         b'huffman', b'block', b'header', b'trailer', b'throughput', b'latency', b'memory')
+TEXT_SEED = 0x9E3779B97F4A7C15
+BINARY_SEED = 0xD1B54A32D192ED03
+COMPRESSED_SEED = 0x8CB92BA72F3D8DD7
+CHUNK_SIZE = 256 * 1024
+FIELDS = ['corpus', 'module', 'operation', 'level', 'threads', 'input_bytes', 'output_bytes', 'ratio', 'iterations', 'seconds', 'mb_per_s']
+
+
+class Random(object):
+    """
+    bench_zlib.c's next_random(), xorshift64* keeping the top 32 bits.
+    """
+    def __init__(self, seed):
+        self.state = seed
+
+    def next(self):
+        x = self.state
+        x ^= x >> 12
+        x ^= (x << 25) & 0xffffffffffffffff
+        x ^= x >> 27
+        self.state = x
+        return ((x * 0x2545F4914F6CDD1D) & 0xffffffffffffffff) >> 32
+
+
+def fill_text(size, seed):
+    generator = Random(seed)
+    data = bytearray()
+    words_in_line = 0
+    while len(data) < size:
+        data += WORDS[generator.next() % len(WORDS)]
+        if len(data) < size:
+            words_in_line += 1
+            if words_in_line >= 12:
+                data += b'\n'
+                words_in_line = 0
+            elif generator.next() % 16 == 0:
+                data += b','
+            else:
+                data += b' '
+    return bytes(data[:size])
+
+
+def fill_binary(size, seed):
+    generator = Random(seed)
+    records = []
+    for counter in range(size // 16 + 1):
+        noise = generator.next()
+        records.append(bytes((
+            counter & 0xff, (counter >> 8) & 0xff, (counter >> 16) & 0xff, 0,
+            noise % 8, 0, 0, 0,
+            noise & 0xff, (noise >> 8) & 0x0f, 0x40, 0x3f,
+            0x00 if noise % 3 else 0xff, 0, 0, 0)))
+    return b''.join(records)[:size]
+
+
+def fill_compressed(size, seed):
+    """
+    Maximally compressed blocks of fresh text.  They are compressed with
+    zlibbuf, which uses the same library and settings as bench_zlib's
+    compress2(), so the bytes match too.
+    """
+    blocks = []
+    length = 0
+    while length < size:
+        block = zlibbuf.compress(fill_text(256 * 1024, seed), 9)
+        blocks.append(block)
+        length += len(block)
+        seed += 1
+    return b''.join(blocks)[:size]
+
+
+def make_corpora(size):
+    """
+    The same three corpora bench_zlib generates for the same --size.
+    """
+    return [('text', fill_text(size, TEXT_SEED)), ('binary', fill_binary(size, BINARY_SEED)), ('compressed', fill_compressed(size, COMPRESSED_SEED))]
+
+
+def check(name, data):
+    """
+    Makes sure both modules read each other's output, whatever kind of
+    buffer the data arrives in.
+    """
+    for wbits in (zlib.MAX_WBITS, -zlib.MAX_WBITS, zlib.MAX_WBITS | 16):
+        ours = zlibbuf.compress(data, 6, wbits)
+        theirs = zlib.compress(data, 6) if wbits == zlib.MAX_WBITS else None
+        assert zlib.decompress(ours, wbits) == data, '%s: zlib cannot read zlibbuf output (wbits %s)' % (name, wbits)
+        assert zlibbuf.decompress(ours, wbits) == data, '%s: zlibbuf round trip failed (wbits %s)' % (name, wbits)
+        if theirs is not None:
+            assert zlibbuf.decompress(theirs, zlib.MAX_WBITS) == data, '%s: zlibbuf cannot read zlib output' % (name)
+
+    view = memoryview(bytearray(data))[len(data) // 4:len(data) // 2]
+    assert zlibbuf.decompress(zlibbuf.compress(view)) == view.tobytes(), '%s: memoryview slice' % (name)
+
+    mapped = mmap.mmap(-1, len(data))
+    try:
+        mapped.write(data)
+        assert zlibbuf.decompress(zlibbuf.compress(mapped)) == data, '%s: mmap' % (name)
+    finally:
+        mapped.close()
+
+    numbers = array.array('B', data)
+    assert zlibbuf.decompress(zlibbuf.compress(numbers)) == data, '%s: array.array' % (name)
+
+    output = bytearray(zlibbuf.compress_bound(len(data)))
+    written = zlibbuf.compress_into(data, output)
+    restored = bytearray(len(data))
+    assert zlibbuf.decompress_into(memoryview(output)[:written], restored) == len(data) and restored == data, '%s: caller-provided buffers' % (name)
+
+    assert zlibbuf.crc32(data) == zlib.crc32(data) & 0xffffffff, '%s: crc32' % (name)
+    assert zlibbuf.adler32(data) == zlib.adler32(data) & 0xffffffff, '%s: adler32' % (name)
+
+
+def measure(function, min_seconds):
+    """
+    Calls function until min_seconds have passed and returns the iteration
+    count and elapsed time.
+    """
+    iterations = 0
+    start = time.time()
+    while True:
+        function()
+        iterations += 1
+        seconds = time.time() - start
+        if seconds >= min_seconds:
+            return iterations, seconds
+
+
+def result(corpus, module, operation, level, threads, input_bytes, output_bytes, iterations, seconds):
+    return {
+        'corpus': corpus,
+        'module': module,
+        'operation': operation,
+        'level': level,
+        'threads': threads,
+        'input_bytes': input_bytes,
+        'output_bytes': output_bytes,
+        'ratio': round(float(input_bytes) / output_bytes, 4) if output_bytes else 0,
+        'iterations': iterations,
+        'seconds': round(seconds, 6),
+        'mb_per_s': round(input_bytes * iterations / seconds / 1e6, 2),
+        }
+
+
+def benchmark(name, data, min_seconds, threads):
+    results = []
+    output = bytearray(zlibbuf.compress_bound(len(data), 1))
+    restored = bytearray(len(data))
+
+    for level in (1, 6, 9):
+        compressed = zlib.compress(data, level)
+        for module, compress, decompress in (
+                ('zlib', lambda: zlib.compress(data, level), lambda: zlib.decompress(compressed)),
+                ('zlibbuf', lambda: zlibbuf.compress(data, level), lambda: zlibbuf.decompress(compressed, zlib.MAX_WBITS, len(data)))):
+            iterations, seconds = measure(compress, min_seconds)
+            results.append(result(name, module, 'compress', level, 1, len(data), len(compressed), iterations, seconds))
+            iterations, seconds = measure(decompress, min_seconds)
+            results.append(result(name, module, 'decompress', level, 1, len(data), len(compressed), iterations, seconds))
+
+        iterations, seconds = measure(lambda: zlibbuf.compress_into(data, output, level), min_seconds)
+        results.append(result(name, 'zlibbuf', 'compress_into', level, 1, len(data), len(compressed), iterations, seconds))
+        iterations, seconds = measure(lambda: zlibbuf.decompress_into(compressed, restored), min_seconds)
+        results.append(result(name, 'zlibbuf', 'decompress_into', level, 1, len(data), len(compressed), iterations, seconds))
+
+    for module, crc32 in (('zlib', zlib.crc32), ('zlibbuf', zlibbuf.crc32)):
+        iterations, seconds = measure(lambda: crc32(data), min_seconds)
+        results.append(result(name, module, 'crc32', 0, 1, len(data), 0, iterations, seconds))
+
+    # Compress independent chunks on a thread pool, the way a service would.
+    # Both modules get memoryview slices, so no chunk is copied.
+    view = memoryview(data)
+    chunks = [view[offset:offset + CHUNK_SIZE] for offset in range(0, len(data), CHUNK_SIZE)]
+    pool = multiprocessing.pool.ThreadPool(threads)
+    try:
+        for module, compress in (('zlib', lambda chunk: zlib.compress(chunk, 6)), ('zlibbuf', lambda chunk: zlibbuf.compress(chunk, 6))):
+            output_bytes = sum(len(block) for block in pool.map(compress, chunks))
+            iterations, seconds = measure(lambda: pool.map(compress, chunks), min_seconds)
+            results.append(result(name, module, 'compress', 6, threads, len(data), output_bytes, iterations, seconds))
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='zlibbuf_benchmark', help='prefix for the .json and .csv results')
+    parser.add_argument('--size', type=int, default=1024, help='size of each corpus in KiB, 1024 like bench_zlib by default')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds to time each operation')
+    parser.add_argument('--threads', type=int, default=multiprocessing.cpu_count(), help='thread pool size')
+    parser.add_argument('--check-only', action='store_true', help='only check the round trips, without timing anything')
+    args = parser.parse_args(argv)
+
+    print('zlibbuf built with zlib %s, running %s; the zlib module uses %s' % (zlibbuf.ZLIB_VERSION, zlibbuf.ZLIB_RUNTIME_VERSION, zlib.ZLIB_RUNTIME_VERSION))
+    corpora = make_corpora(args.size * 1024)
+    for name, data in corpora:
+        check(name, data)
+    print('zlibbuf round trips match the zlib module')
+    if args.check_only:
+        return 0
+
+    results = []
+    for name, data in corpora:
+        results.extend(benchmark(name, data, args.min_time, args.threads))
+
+    with open(args.output + '.json', 'w') as output:
+        json.dump({
+            'python_version': sys.version.split()[0],
+            'zlib_module_version': zlib.ZLIB_RUNTIME_VERSION,
+            'zlibbuf_version': zlibbuf.ZLIB_RUNTIME_VERSION,
+            'corpus_bytes': args.size * 1024,
+            'min_seconds': args.min_time,
+            'threads': args.threads,
+            'results': results,
+            }, output, indent=2, sort_keys=True)
+    with open(args.output + '.csv', 'w') as output:
+        writer = csv.DictWriter(output, FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+    print('%-10s  %-15s  %5s  %7s  %12s  %12s  %7s' % ('corpus', 'operation', 'level', 'threads', 'zlib MB/s', 'zlibbuf MB/s', 'speedup'))
+    baseline = dict(((r['corpus'], r['operation'], r['level'], r['threads']), r['mb_per_s']) for r in results if r['module'] == 'zlib')
+    for r in results:
+        if r['module'] != 'zlibbuf':
+            continue
+        operation = 'compress' if r['operation'] == 'compress_into' else 'decompress' if r['operation'] == 'decompress_into' else r['operation']
+        reference = baseline.get((r['corpus'], operation, r['level'], r['threads']))
+        speedup = '%6.2fx' % (r['mb_per_s'] / reference) if reference else ''
+        print('%-10s  %-15s  %5s  %7s  %12.1f  %12.1f  %7s' % (r['corpus'], r['operation'], r['level'], r['threads'], reference or 0, r['mb_per_s'], speedup))
+    print('Results written to %s.json and %s.csv' % (args.output, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
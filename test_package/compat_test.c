@@ -0,0 +1,83 @@
+#include <zlib.h>
+
+#include <stdio.h>
+#include <string.h>
+
+
+/*
+ * Exercises the parts of the zlib ABI a consumer depends on: the z_stream
+ * layout, which deflateInit() and inflateInit() check against the library,
+ * the one-shot functions, and the checksums.  The test package also builds
+ * this with a different release of the compiler zlib was built with.
+ */
+
+#define INPUT_SIZE 65536
+
+
+int main(int argc, char **argv) {
+    static unsigned char input[INPUT_SIZE];
+    static unsigned char compressed[INPUT_SIZE * 2];
+    static unsigned char output[INPUT_SIZE];
+    uLongf compressed_size = sizeof(compressed);
+    uLongf output_size = sizeof(output);
+    z_stream stream;
+    int i;
+
+    for (i = 0; i < INPUT_SIZE; ++i) {
+        input[i] = (unsigned char) ((i * 7) ^ (i >> 5));
+    }
+
+    if (strncmp(zlibVersion(), ZLIB_VERSION, 4) != 0) {
+        fprintf(stderr, "compiled against zlib %s but running %s\n", ZLIB_VERSION, zlibVersion());
+        return 1;
+    }
+
+    if (compress2(compressed, &compressed_size, input, INPUT_SIZE, 6) != Z_OK ||
+        uncompress(output, &output_size, compressed, compressed_size) != Z_OK ||
+        output_size != INPUT_SIZE || memcmp(input, output, INPUT_SIZE) != 0) {
+        fprintf(stderr, "compress2 and uncompress did not round trip\n");
+        return 1;
+    }
+
+    memset(&stream, 0, sizeof(stream));
+    if (deflateInit(&stream, Z_BEST_SPEED) != Z_OK) {
+        fprintf(stderr, "deflateInit rejected this z_stream\n");
+        return 1;
+    }
+    stream.next_in = input;
+    stream.avail_in = INPUT_SIZE;
+    stream.next_out = compressed;
+    stream.avail_out = sizeof(compressed);
+    if (deflate(&stream, Z_FINISH) != Z_STREAM_END) {
+        fprintf(stderr, "deflate failed\n");
+        return 1;
+    }
+    compressed_size = stream.total_out;
+    deflateEnd(&stream);
+
+    memset(&stream, 0, sizeof(stream));
+    if (inflateInit(&stream) != Z_OK) {
+        fprintf(stderr, "inflateInit rejected this z_stream\n");
+        return 1;
+    }
+    stream.next_in = compressed;
+    stream.avail_in = (uInt) compressed_size;
+    stream.next_out = output;
+    stream.avail_out = sizeof(output);
+    if (inflate(&stream, Z_FINISH) != Z_STREAM_END || stream.total_out != INPUT_SIZE ||
+        memcmp(input, output, INPUT_SIZE) != 0) {
+        fprintf(stderr, "inflate did not restore the input\n");
+        return 1;
+    }
+    inflateEnd(&stream);
+
+    if (crc32(0L, input, INPUT_SIZE) != crc32_combine(crc32(0L, input, INPUT_SIZE / 2),
+                                                      crc32(0L, input + INPUT_SIZE / 2, INPUT_SIZE / 2),
+                                                      INPUT_SIZE / 2)) {
+        fprintf(stderr, "crc32_combine disagrees with crc32\n");
+        return 1;
+    }
+
+    printf("zlib %s round trip passed\n", zlibVersion());
+    return 0;
+}
@@ -1,4 +1,10 @@
+import contextlib
+import glob
+import gzip
+import json
 import os
+import re
+import subprocess
 
 import conans
 
@@ -9,7 +15,7 @@ class ConanZlibUser(conans.ConanFile):
     This uses Conan's CMake integration to build.
     """
     settings = 'os', 'compiler', 'build_type', 'arch'
-    exports_sources = 'CMakeLists.txt', 'main.cpp'
+    exports_sources = 'CMakeLists.txt', 'main.c', 'main.cpp', 'bench_zlib.c', 'cpu_check.c', 'minizip_test.c', 'compat_test.c', 'bench_zlibbuf.py'
     requires = 'zlib/1.2.11@kent_at_multiscale/stable'
     generators = 'cmake', 'env', 'txt'
     
@@ -50,12 +56,233 @@ class ConanZlibUser(conans.ConanFile):
         self.output.info('Compiling')
         cmake.build(self, ['--', '-j%s' % (cpu_count)])
         
+        self._check_cpu()
+        
         self.output.info('Running tests')
         self.run('ctest --parallel %s' % (cpu_count))
     
+    def _check_cpu(self):
+        """
+        Make sure this machine can run the instruction set zlib was compiled
+        for before running anything that links to it.
+        """
+        march = self.deps_user_info['zlib'].vars.get('march', 'default')
+        self.output.info('Checking that this CPU supports zlib built with march=%s' % (march))
+        self.run('%s %s' % (os.path.join(os.curdir, 'bin', 'cpu_check'), march))
+    
+    def _check_pkgconfig(self):
+        """
+        Make sure the pkg-config files in the package were rewritten to refer
+        to the Conan storage directory through a variable, not a fixed path.
+        """
+        rootpath = self.deps_cpp_info['zlib'].rootpath
+        storage_path = rootpath[:rootpath.index(os.sep + 'zlib' + os.sep)]
+        for pkgconfig_file in glob.glob(os.path.join(rootpath, '*', 'pkgconfig', '*.pc')):
+            self.output.info('Checking pkg-config file %s' % (pkgconfig_file))
+            with open(pkgconfig_file, 'r') as input:
+                lines = input.readlines()
+            if lines[0] != 'conan_storage_path=~/.conan/data\n':
+                raise conans.errors.ConanException('%s does not start with the conan_storage_path variable' % (pkgconfig_file))
+            if any(storage_path in line for line in lines):
+                raise conans.errors.ConanException('%s still contains the Conan storage directory %s' % (pkgconfig_file, storage_path))
+            if not any(line.startswith('prefix=${conan_storage_path}') for line in lines):
+                raise conans.errors.ConanException('%s does not set prefix relative to ${conan_storage_path}' % (pkgconfig_file))
+    
+    def _check_manifest(self):
+        """
+        Make sure the package manifest matches what is in the package: the
+        libraries for the chosen linkage at their actual sizes, the timed
+        build phases, and the compiler flags the options call for.
+        """
+        rootpath = self.deps_cpp_info['zlib'].rootpath
+        manifest_file = os.path.join(rootpath, 'zlib_manifest.json')
+        self.output.info('Checking package manifest %s' % (manifest_file))
+        with open(manifest_file, 'r') as input:
+            manifest = json.load(input)
+        options = manifest['options']
+        
+        libraries = manifest['libraries']
+        shared_libraries = [name for name in libraries if not name.endswith('.a')]
+        if bool(shared_libraries) != (options['shared'] == 'True'):
+            raise conans.errors.ConanException('The manifest lists shared libraries %s, but the package was built with shared=%s' % (shared_libraries, options['shared']))
+        for name, library in libraries.items():
+            size = os.path.getsize(os.path.join(rootpath, 'lib', name))
+            if library['bytes'] != size:
+                raise conans.errors.ConanException('The manifest says %s is %s bytes, but it is %s' % (name, library['bytes'], size))
+            if library['exported_symbols'] is not None and library['exported_symbols'] < 1:
+                raise conans.errors.ConanException('The manifest says %s exports no symbols' % (name))
+        
+        phases = [phase['phase'] for phase in manifest['phases']]
+        if 'compile' not in phases:
+            raise conans.errors.ConanException('The manifest has no compile phase, only %s' % (phases))
+        
+        cflags = manifest['flags'].get('CFLAGS', '').split()
+        expected_flags = []
+        if options['march'] != 'default':
+            expected_flags.append('-march=%s' % (options['march']))
+        if options['optimize'] != 'none':
+            expected_flags.append('-flto')
+        if options['gc_sections'] == 'True':
+            expected_flags.extend(['-ffunction-sections', '-fdata-sections', '-fvisibility=hidden'])
+        for flag in expected_flags:
+            if flag not in cflags:
+                raise conans.errors.ConanException('zlib was not compiled with %s, according to the manifest' % (flag))
+        
+        for result in manifest['benchmarks']:
+            self.output.info('Build benchmark at level %s: compress %s MB/s, decompress %s MB/s' % (result['level'], result['compress_mb_per_s'], result['decompress_mb_per_s']))
+    
+    def _check_compiler_version(self):
+        """
+        The package ID only records the compiler's major version, so this
+        binary may come from a different release of the compiler than the
+        one building this test.  Make sure it is a release zlib's package_id()
+        allows.
+        
+        When the package ID merges releases, also build compat_test.c with
+        another release of the same major version against the package and
+        run it, to show that neighbouring releases link and run against the
+        binary.  `--scope ALL:compatCompiler=<cc>` names that compiler;
+        otherwise the first one found on the PATH is used.  If there is
+        none, say loudly that the merge went unverified.
+        """
+        with open(os.path.join(self.deps_cpp_info['zlib'].rootpath, 'zlib_manifest.json'), 'r') as input:
+            manifest = json.load(input)
+        built_compiler = manifest['settings']['compiler']
+        built_version = manifest['settings']['compiler.version']
+        consumer_compiler = str(self.settings.compiler)
+        consumer_version = str(self.settings.compiler.version)
+        options = manifest['options']
+        if built_compiler != consumer_compiler:
+            raise conans.errors.ConanException('zlib was built with %s, but this test uses %s' % (built_compiler, consumer_compiler))
+        if built_version != consumer_version:
+            if options['exact_compiler_version'] == 'True' or options['optimize'] != 'none':
+                raise conans.errors.ConanException('zlib was built with %s %s, but its package ID should require exactly %s %s' % (built_compiler, built_version, consumer_compiler, consumer_version))
+            if built_version.split('.')[0] != consumer_version.split('.')[0]:
+                raise conans.errors.ConanException('zlib was built with %s %s, which is not compatible with %s %s' % (built_compiler, built_version, consumer_compiler, consumer_version))
+            self.output.info('Using zlib built with %s %s from %s %s' % (built_compiler, built_version, consumer_compiler, consumer_version))
+        
+        # Mirror the releases zlib's package_id() merges.
+        built_major = int(built_version.split('.')[0])
+        merged = options['exact_compiler_version'] != 'True' and options['optimize'] == 'none' and ((built_compiler == 'gcc' and built_major >= 5) or (built_compiler == 'clang' and built_major >= 4) or built_compiler == 'apple-clang')
+        if not merged:
+            return
+        
+        compat_compiler = self.scope.compatCompiler
+        if not compat_compiler:
+            family = 'gcc' if built_compiler == 'gcc' else 'clang'
+            own_release = self._compiler_release(os.getenv('CC', family))
+            compat_compiler = self._find_neighbouring_compiler(family, own_release)
+            if not compat_compiler:
+                self.output.warn('Compiler compatibility check skipped: no other %s %s release is on the PATH, so sharing this binary across %s %s releases is unverified.  Pass --scope ALL:compatCompiler=<cc> to check it.' % (family, built_major, built_compiler, built_major))
+                return
+        zlib = self.deps_cpp_info['zlib']
+        executable = os.path.join(os.curdir, 'bin', 'compat_test_%s' % (os.path.basename(str(compat_compiler))))
+        arguments = ['-std=c11', '-o', '"%s"' % (executable), '"%s"' % (os.path.join(self.conanfile_directory, 'compat_test.c'))]
+        arguments.extend('-D%s' % (define) for define in zlib.defines)
+        arguments.extend('-I"%s"' % (path) for path in zlib.include_paths)
+        arguments.extend('-L"%s"' % (path) for path in zlib.lib_paths)
+        arguments.extend('-Wl,-rpath,"%s"' % (path) for path in zlib.lib_paths)
+        arguments.extend('-l%s' % (lib) for lib in zlib.libs)
+        self.output.info('Building compat_test with %s' % (compat_compiler))
+        self.run('"%s" --version' % (compat_compiler))
+        self.run('"%s" %s' % (compat_compiler, ' '.join(arguments)))
+        self.run(executable)
+    
+    @staticmethod
+    def _compiler_release(compiler):
+        """
+        Returns the version a compiler reports in the first line of its
+        `--version` output, such as 7.3.0, or None if it cannot be run.
+        """
+        try:
+            output = subprocess.check_output([compiler, '--version'], stderr=subprocess.STDOUT).decode('utf-8', 'replace')
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        match = re.search(r'\b(\d+\.\d+(\.\d+)?)', output.split('\n')[0])
+        return match.group(1) if match else None
+    
+    def _find_neighbouring_compiler(self, family, own_release):
+        """
+        Looks on the PATH for a gcc or clang, plain or with a version suffix
+        like gcc-7, that reports the same major version as own_release but a
+        different release.
+        """
+        if not own_release:
+            return None
+        pattern = re.compile(r'^%s(-[0-9.]+)?$' % (family))
+        seen = set()
+        for directory in os.getenv('PATH', '').split(os.pathsep):
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                compiler = os.path.join(directory, name)
+                if not pattern.match(name) or not os.access(compiler, os.X_OK) or os.path.realpath(compiler) in seen:
+                    continue
+                seen.add(os.path.realpath(compiler))
+                release = self._compiler_release(compiler)
+                if release and release != own_release and release.split('.')[0] == own_release.split('.')[0]:
+                    self.output.info('Found %s %s next to this test\'s %s %s' % (compiler, release, family, own_release))
+                    return compiler
+        return None
+    
+    def _check_pgzip(self):
+        """
+        If the package was built with contrib=True, compress a file with pgzip
+        using several threads and small blocks, and make sure an independent
+        gzip reader gets the same bytes back.
+        """
+        pgzip = os.path.join(self.deps_cpp_info['zlib'].rootpath, 'bin', 'pgzip')
+        if not os.path.isfile(pgzip):
+            return
+        original = os.path.join(os.path.realpath(os.curdir), 'pgzip_test.bin')
+        # Enough blocks to span several batches of work.
+        with open(pgzip, 'rb') as input:
+            data = input.read() * 32
+        with open(original, 'wb') as output:
+            output.write(data)
+        self.output.info('Compressing %s bytes with pgzip' % (len(data)))
+        self.run('"%s" -f -k -p 4 -b 32 "%s"' % (pgzip, original))
+        with contextlib.closing(gzip.open(original + '.gz', 'rb')) as input:
+            if input.read() != data:
+                raise conans.errors.ConanException('pgzip output does not decompress to the original data')
+    
+    def _check_python(self):
+        """
+        If the package includes the zlibbuf extension, check it against the
+        standard library's zlib module with the interpreter it was built for,
+        and benchmark the two unless benchmarks are skipped.
+        """
+        python = self.deps_user_info['zlib'].vars.get('python')
+        if not python:
+            return
+        script = os.path.join(self.conanfile_directory, 'bench_zlibbuf.py')
+        pythonpath = os.path.join(self.deps_cpp_info['zlib'].rootpath, 'lib', 'python')
+        with conans.tools.environment_append({'PYTHONPATH': pythonpath}):
+            if self.scope.skipBenchmark:
+                self.run('"%s" "%s" --check-only' % (python, script))
+            else:
+                benchmark_prefix = os.path.join(os.path.realpath(os.curdir), 'zlibbuf_benchmark')
+                self.output.info('Running Python benchmark, writing results to %s.json and %s.csv' % (benchmark_prefix, benchmark_prefix))
+                self.run('"%s" "%s" --output "%s"' % (python, script, benchmark_prefix))
+    
     def test(self):
         cpu_count = conans.tools.cpu_count()
         self.output.info('Detected %s CPUs' % cpu_count)
         
+        self._check_cpu()
+        self._check_pkgconfig()
+        self._check_manifest()
+        self._check_compiler_version()
+        self._check_pgzip()
+        
         self.output.info('Running tests')
         self.run('ctest --parallel %s' % (cpu_count))
+        
+        # The benchmark runs on its own rather than under CTest so that it
+        # does not compete with the other tests for cores.
+        if not self.scope.skipBenchmark:
+            benchmark_prefix = os.path.join(os.path.realpath(os.curdir), 'zlib_benchmark')
+            self.output.info('Running benchmark, writing results to %s.json and %s.csv' % (benchmark_prefix, benchmark_prefix))
+            self.run('%s --output "%s"' % (os.path.join(os.curdir, 'bin', 'bench_zlib'), benchmark_prefix))
+        
+        self._check_python()
@@ -0,0 +1,97 @@
+#include <stdio.h>
+#include <string.h>
+
+#if (defined(__x86_64__) || defined(__i386__)) && defined(__GNUC__)
+#include <cpuid.h>
+#endif
+
+
+/*
+ * Verifies that the CPU running the tests implements the micro-architecture
+ * level zlib was compiled for with -march.  Running code built for a newer
+ * level on an older CPU dies with an illegal instruction at some arbitrary
+ * point, so this gives a clear message up front instead.
+ */
+
+#define REQUIRE_FEATURE(feature) \
+    if (!__builtin_cpu_supports(feature)) { \
+        fprintf(stderr, "this CPU does not support %s, which %s requires\n", feature, level); \
+        ++missing; \
+    }
+
+/*
+ * __builtin_cpu_supports() does not know every feature the levels require
+ * in every GCC and Clang release, so the rest come straight from CPUID.
+ */
+#define REQUIRE_CPUID_BIT(feature, reg, bit) \
+    if (!((reg >> bit) & 1)) { \
+        fprintf(stderr, "this CPU does not support %s, which %s requires\n", feature, level); \
+        ++missing; \
+    }
+
+
+int main(int argc, char **argv) {
+    const char *level = argc > 1 ? argv[1] : "default";
+
+    if (strcmp(level, "default") == 0) {
+        printf("zlib was built for the compiler's default target\n");
+        return 0;
+    }
+    if (strcmp(level, "native") == 0) {
+        printf("zlib was built for the CPU of the build machine; make sure it matches this one\n");
+        return 0;
+    }
+
+#if (defined(__x86_64__) || defined(__i386__)) && defined(__GNUC__)
+    {
+        int missing = 0;
+        int v2 = strcmp(level, "x86-64-v2") == 0;
+        int v3 = strcmp(level, "x86-64-v3") == 0;
+        unsigned int eax = 0, ebx = 0, ecx_basic = 0, edx = 0;
+        unsigned int ecx_extended = 0;
+
+        if (!v2 && !v3 && strcmp(level, "x86-64") != 0) {
+            fprintf(stderr, "unknown micro-architecture level %s\n", level);
+            return 1;
+        }
+
+        __builtin_cpu_init();
+        __get_cpuid(1, &eax, &ebx, &ecx_basic, &edx);
+        if (__get_cpuid(0x80000001, &eax, &ebx, &ecx_extended, &edx) == 0) {
+            ecx_extended = 0;
+        }
+        /* Every x86-64 CPU implements the baseline level. */
+        if (v2 || v3) {
+            REQUIRE_CPUID_BIT("cx16", ecx_basic, 13)
+            REQUIRE_CPUID_BIT("lahf_lm", ecx_extended, 0)
+            REQUIRE_FEATURE("popcnt")
+            REQUIRE_FEATURE("sse3")
+            REQUIRE_FEATURE("ssse3")
+            REQUIRE_FEATURE("sse4.1")
+            REQUIRE_FEATURE("sse4.2")
+        }
+        if (v3) {
+            /* The builtin's avx also checks that the OS saves the AVX state. */
+            REQUIRE_FEATURE("avx")
+            REQUIRE_FEATURE("avx2")
+            REQUIRE_FEATURE("bmi")
+            REQUIRE_FEATURE("bmi2")
+            REQUIRE_CPUID_BIT("f16c", ecx_basic, 29)
+            REQUIRE_FEATURE("fma")
+            REQUIRE_CPUID_BIT("lzcnt", ecx_extended, 5)
+            REQUIRE_CPUID_BIT("movbe", ecx_basic, 22)
+            REQUIRE_CPUID_BIT("xsave", ecx_basic, 26)
+        }
+
+        if (missing) {
+            fprintf(stderr, "zlib was built for %s, which this CPU cannot run\n", level);
+            return 1;
+        }
+        printf("this CPU supports %s\n", level);
+        return 0;
+    }
+#else
+    fprintf(stderr, "unable to check for %s on this platform\n", level);
+    return 1;
+#endif
+}
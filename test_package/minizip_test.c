@@ -0,0 +1,63 @@
+#include <minizip/zip.h>
+#include <minizip/unzip.h>
+
+#include <stdio.h>
+#include <string.h>
+
+
+/*
+ * Writes a zip archive with minizip and reads the entry back, to check that
+ * libminizip was packaged and links against this zlib.
+ */
+
+static const char entry_name[] = "hello.txt";
+static const char contents[] = "Hello from minizip, compressed by zlib.\n";
+
+
+int main(int argc, char **argv) {
+    const char *path = argc > 1 ? argv[1] : "minizip_test.zip";
+    zip_fileinfo info;
+    zipFile zip;
+    unzFile unzip;
+    char buffer[sizeof(contents)];
+    int count;
+
+    memset(&info, 0, sizeof(info));
+    zip = zipOpen(path, APPEND_STATUS_CREATE);
+    if (zip == NULL) {
+        fprintf(stderr, "unable to create %s\n", path);
+        return 1;
+    }
+    if (zipOpenNewFileInZip(zip, entry_name, &info, NULL, 0, NULL, 0, NULL, Z_DEFLATED, Z_BEST_COMPRESSION) != ZIP_OK ||
+        zipWriteInFileInZip(zip, contents, (unsigned)strlen(contents)) != ZIP_OK ||
+        zipCloseFileInZip(zip) != ZIP_OK) {
+        fprintf(stderr, "unable to write %s to %s\n", entry_name, path);
+        zipClose(zip, NULL);
+        return 1;
+    }
+    if (zipClose(zip, NULL) != ZIP_OK) {
+        fprintf(stderr, "unable to finish %s\n", path);
+        return 1;
+    }
+
+    unzip = unzOpen(path);
+    if (unzip == NULL) {
+        fprintf(stderr, "unable to open %s\n", path);
+        return 1;
+    }
+    if (unzLocateFile(unzip, entry_name, 1) != UNZ_OK || unzOpenCurrentFile(unzip) != UNZ_OK) {
+        fprintf(stderr, "unable to find %s in %s\n", entry_name, path);
+        unzClose(unzip);
+        return 1;
+    }
+    count = unzReadCurrentFile(unzip, buffer, sizeof(buffer));
+    unzCloseCurrentFile(unzip);
+    unzClose(unzip);
+    if (count != (int)strlen(contents) || memcmp(buffer, contents, (size_t)count) != 0) {
+        fprintf(stderr, "%s came back different from what was written\n", entry_name);
+        return 1;
+    }
+
+    printf("minizip round trip of %s succeeded\n", entry_name);
+    return 0;
+}